@@ -3,6 +3,7 @@
 #include <Wire.h>
 #include <Adafruit_GFX.h>
 #include <Adafruit_SSD1306.h>
+#include <util/crc16.h>
 
 #define OLED_RESET 4
 Adafruit_SSD1306 display(OLED_RESET);
@@ -52,6 +53,19 @@ const int ledPin =  13;      // the number of the LED pin
 
 unsigned char image_buffer[128*32 / 8];
 
+// Framed protocol, see readFrame. Baud rates are picked by their index in
+// the handshake, the same table as BAUD_RATES on the host.
+const long baudRates[] = {57600, 115200, 250000, 500000};
+const int baudRateCount = 4;
+const unsigned long pingTimeout = 1000;  // ms to wait for a ping at a new rate
+const unsigned int maxPayload = 128*32 / 8 + 8;  // PackBits worst case
+int framedOnly = 0;      // after a handshake, ignore unframed frames
+unsigned char lastSequence = 0;
+int needFullFrame = 1;   // refuse deltas until a full frame was shown
+int framing = 0;         // readInput is inside a packet
+unsigned int frameRemaining = 0;
+uint16_t frameCrc = 0;
+
 int inByte = 0;
 int prevButtonState = 0;         // variable for reading the pushbutton status
 int prevTriggered = 0;
@@ -148,11 +162,231 @@ void loop() {
   };
 
   inByte = Serial.read();
-  if (inByte == 73) {
+  if (framedOnly && (inByte == 73 || inByte == 68 || inByte == 67
+                     || inByte == 72)) {
+    // noise, the host only sends packets now and a new handshake
+    // needs a reset, which the host gets by reopening the port
+  } else if (inByte == 73) {
     Serial.readBytes(image_buffer, 512);
     Serial.println("end_image");
-    display.clearDisplay();
-    display.drawBitmap(0, 0, image_buffer, 128, 32, WHITE);
-    display.display();
+    showImageBuffer();
+  } else if (inByte == 68) {
+    if (readDelta()) {
+      Serial.println("end_image");
+      showImageBuffer();
+    } else {
+      Serial.println("resync");
+    }
+  } else if (inByte == 67) {
+    if (readPackBits()) {
+      Serial.println("end_image");
+      showImageBuffer();
+    } else {
+      Serial.println("resync");
+    }
+  } else if (inByte == 0xA5) {
+    readFrame();
+  } else if (inByte == 72) {
+    negotiateBaudRate();
+  } else if (inByte == 80) {
+    Serial.println("pong");
+    framedOnly = 1;
+  } else if (inByte == 85) {
+    leaveFramedProtocol();
+  }
+}
+
+// 'U' 0xAA: back to unframed frames at 57600. The host sends it when it
+// gave up on a handshake whose "pong" it may have missed. The second byte
+// keeps noise between packets from ending the framed protocol.
+void leaveFramedProtocol() {
+  unsigned char check;
+  if (Serial.readBytes(&check, 1) != 1 || check != 0xAA) {
+    return;
+  }
+  Serial.flush();
+  Serial.begin(57600);
+  framedOnly = 0;
+}
+
+// 'H' <baud rate index>: answer "baud <rate>" with the highest rate both
+// sides support and switch to it. The host must ping ('P') at that rate
+// within pingTimeout, otherwise go back to 57600 where it pings again.
+void negotiateBaudRate() {
+  unsigned char code;
+  if (Serial.readBytes(&code, 1) != 1) {
+    return;
+  }
+  if (code >= baudRateCount) {
+    code = baudRateCount - 1;
+  }
+  Serial.print("baud ");
+  Serial.println(baudRates[code]);
+  Serial.flush();
+  Serial.begin(baudRates[code]);
+  unsigned long start = millis();
+  while (millis() - start < pingTimeout) {
+    if (Serial.available() && Serial.read() == 80) {
+      Serial.println("pong");
+      framedOnly = 1;
+      return;
+    }
+  }
+  Serial.begin(57600);
+}
+
+// Reads length bytes of the image data. Inside a packet it also keeps the
+// CRC and refuses to read past the payload length.
+int readInput(unsigned char *buffer, unsigned int length) {
+  if (framing && length > frameRemaining) {
+    return 0;
+  }
+  if (Serial.readBytes(buffer, length) != length) {
+    return 0;
+  }
+  if (framing) {
+    frameRemaining -= length;
+    for (unsigned int i = 0; i < length; i++) {
+      frameCrc = _crc_xmodem_update(frameCrc, buffer[i]);
+    }
+  }
+  return 1;
+}
+
+// 0xA5 <sequence> <command> <length high> <length low> <payload>
+// <CRC high> <CRC low>, where command and payload are an 'I', 'D' or 'C'
+// frame and the CRC-16/CCITT covers everything after 0xA5.
+// Answers "ack <sequence>" once the frame is on screen, so the host knows
+// the receive buffer is free again, or "nak <sequence>" if the packet is
+// damaged. After a failure only full frames are taken until one is shown,
+// deltas would patch a buffer the host no longer knows.
+void readFrame() {
+  unsigned char header[4];
+  unsigned char crc[2];
+  unsigned char skipped;
+  if (Serial.readBytes(header, 4) != 4) {
+    return;  // the host times out waiting for the ack
+  }
+  unsigned char sequence = header[0];
+  unsigned char command = header[1];
+  framing = 1;
+  frameCrc = 0xFFFF;
+  for (int i = 0; i < 4; i++) {
+    frameCrc = _crc_xmodem_update(frameCrc, header[i]);
+  }
+  frameRemaining = ((unsigned int)header[2] << 8) | header[3];
+  if (frameRemaining > maxPayload) {
+    // a damaged length, resynchronise on the next start byte instead
+    framing = 0;
+    needFullFrame = 1;
+    Serial.print("nak ");
+    Serial.println(sequence);
+    return;
+  }
+
+  int ok = 0;
+  if (command == 73) {
+    ok = readInput(image_buffer, sizeof(image_buffer));
+  } else if (command == 67) {
+    ok = readPackBits();
+  } else if (command == 68 && !needFullFrame
+             && sequence == (unsigned char)(lastSequence + 1)) {
+    ok = readDelta();
+  }
+  // keep in step with the host whatever went wrong
+  while (frameRemaining > 0 && readInput(&skipped, 1)) {
+  }
+  framing = 0;
+  if (Serial.readBytes(crc, 2) != 2) {
+    ok = 0;
+  }
+  ok = ok && frameRemaining == 0
+       && frameCrc == (((uint16_t)crc[0] << 8) | crc[1]);
+
+  if (ok) {
+    lastSequence = sequence;
+    if (command != 68) {
+      needFullFrame = 0;
+    }
+    showImageBuffer();
+    Serial.print("ack ");
+  } else {
+    needFullFrame = 1;
+    Serial.print("nak ");
+  }
+  Serial.println(sequence);
+}
+
+void showImageBuffer() {
+  display.clearDisplay();
+  display.drawBitmap(0, 0, image_buffer, 128, 32, WHITE);
+  display.display();
+}
+
+// 'D' <range count> then per range: <offset high> <offset low> <length> <bytes>
+// Patches image_buffer in place. Returns 0 if the ranges are malformed so
+// the host sends a full frame again. Every declared byte is read even then,
+// the bytes of a bad range must not be taken for commands.
+int readDelta() {
+  unsigned char header[3];
+  unsigned char ranges;
+  unsigned char skipped;
+  int ok = 1;
+  if (!readInput(&ranges, 1)) {
+    return 0;
+  }
+  for (int i = 0; i < ranges; i++) {
+    if (!readInput(header, 3)) {
+      return 0;
+    }
+    unsigned int offset = ((unsigned int)header[0] << 8) | header[1];
+    unsigned int length = header[2];
+    if (offset + length > sizeof(image_buffer)) {
+      ok = 0;
+      for (unsigned int j = 0; j < length; j++) {
+        if (!readInput(&skipped, 1)) {
+          return 0;
+        }
+      }
+    } else if (!readInput(image_buffer + offset, length)) {
+      return 0;
+    }
+  }
+  return ok;
+}
+
+
+// 'C' followed by a PackBits stream that expands to exactly 512 bytes.
+// Header n < 128: n + 1 literal bytes follow. n > 128: the next byte is
+// repeated 257 - n times. Decodes straight into image_buffer.
+int readPackBits() {
+  unsigned char header;
+  unsigned char value;
+  unsigned int position = 0;
+  while (position < sizeof(image_buffer)) {
+    if (!readInput(&header, 1)) {
+      return 0;
+    }
+    if (header < 128) {
+      unsigned int length = header + 1;
+      if (position + length > sizeof(image_buffer)) {
+        return 0;
+      }
+      if (!readInput(image_buffer + position, length)) {
+        return 0;
+      }
+      position += length;
+    } else if (header > 128) {
+      unsigned int length = 257 - header;
+      if (position + length > sizeof(image_buffer)) {
+        return 0;
+      }
+      if (!readInput(&value, 1)) {
+        return 0;
+      }
+      memset(image_buffer + position, value, length);
+      position += length;
+    }
   }
+  return 1;
 }
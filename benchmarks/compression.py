@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compare raw and PackBits frame sizes for the screens the device shows.
+
+Usage: python benchmarks/compression.py
+"""
+
+import sys
+from os import path
+
+BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from PIL import Image  # noqa: E402
+
+from core.issues import IssueSummary  # noqa: E402
+from display.base import DisplayIssue, DisplayText  # noqa: E402
+from display.encoder import (  # noqa: E402
+    IMAGE_COMMAND, full_frame, pack_image, packbits, wire_time
+)
+
+
+def fake_issue(key, summary, timespent=None):
+    return IssueSummary(key, key, summary, timespent=timespent)
+
+
+def screens():
+    """Yield (name, image) for every kind of screen the host sends."""
+    issue = fake_issue("PROJ-1234", "Fix the login page", 3 * 60 * 60)
+    yield "issue running", DisplayIssue(issue, "running", "12:34").image
+    yield "issue paused", DisplayIssue(issue, "paused").image
+    yield "issue blinking", DisplayIssue(issue, "running", "45:07",
+                                         inversed_colors=True).image
+    yield "text short", DisplayText("PROJ-1: Deploy").image
+    yield "text long", DisplayText(
+        "PROJ-1234: Investigate intermittent timeouts on the payments "
+        "webhook and add retries with exponential backoff"
+    ).image
+    yield "text empty", DisplayText("You do not have any tasks").image
+    for name in ("si.gif", "pm.gif"):
+        gif = Image.open(path.join(BASE_DIR, "images", name))
+        for frame in range(gif.n_frames):
+            gif.seek(frame)
+            yield "{} #{}".format(name, frame), gif.copy().convert(mode="1")
+
+
+def main():
+    print("{:<20} {:>5} {:>5} {:>7} {:>8} {:>8}".format(
+        "screen", "raw", "rle", "ratio", "raw ms", "sent ms"))
+    total_raw = total_sent = 0
+    for name, image in screens():
+        bitmap = pack_image(image)
+        raw = len(IMAGE_COMMAND + bitmap)
+        rle = 1 + len(packbits(bitmap))
+        sent = len(full_frame(bitmap))
+        total_raw += raw
+        total_sent += sent
+        print("{:<20} {:>5} {:>5} {:>6.1f}x {:>8.1f} {:>8.1f}".format(
+            name, raw, rle, raw / rle,
+            wire_time(raw) * 1000, wire_time(sent) * 1000))
+    print("total: {} -> {} bytes ({:.1f}x)".format(
+        total_raw, total_sent, total_raw / total_sent))
+
+
+if __name__ == '__main__':
+    main()
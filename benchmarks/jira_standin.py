@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A local stand-in for the Jira REST API, with latency and failure injection.
+
+Usage: python benchmarks/jira_standin.py [--port 8080] [--latency 0.2]
+           [--error-rate 0.1] [--rate-limit 5] [--page-size 20] [--scenario]
+
+Serves the endpoints the jira client uses here (serverInfo, field, search,
+issue, issue transitions and worklog) from an in-memory set of issues, all
+assigned to whoever logs in. Point "account_url" at it in the config.
+
+With --scenario it instead runs a load scenario: a Manager drives a virtual
+Arduino against the stand-in, buttons are pushed in a script, and the time
+to the next screen update and the HTTP calls of every push are reported.
+"""
+
+import argparse
+import json
+import math
+import re
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from os import path
+from random import random
+from time import monotonic, sleep
+from urllib.parse import parse_qs, urlsplit
+
+BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from core.http_stats import endpoint  # noqa: E402
+from benchmarks.suite import IN_PROGRESS, SUMMARIES, TODO  # noqa: E402
+
+DONE = "4"
+PROJECT_ID = "1"
+API_PATH = "/rest/api/2/"
+MAX_PAGE_SIZE = 1000
+# target status id -> transition id, every status reachable from any other
+TRANSITIONS = {TODO: "11", IN_PROGRESS: "21", DONE: "31"}
+STATUS_NAMES = {TODO: "To Do", IN_PROGRESS: "In Progress", DONE: "Done"}
+FIELDS = ("summary", "status", "timespent", "project", "issuetype")
+
+_STATUS_FILTER = re.compile(r"status in \(([^)]*)\)")
+_UPDATED_FILTER = re.compile(r"updated >= -(\d+)m")
+
+
+class Reply(Exception):
+    """Stop handling a request and answer with status and body."""
+
+    def __init__(self, status, body=None, headers=None):
+        super().__init__(status)
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+class JiraStandIn:
+
+    def __init__(self, issues=40, latency=0, error_rate=0, rate_limit=None,
+                 page_size=MAX_PAGE_SIZE, port=0):
+        """Stand-in definition, serving once start is called.
+
+        self.issues = {
+            <issue id>: {"id": "10000", "key": "PROJ-0", "summary": "...",
+                         "status": "1", "timespent": 3600,
+                         "updated": <unix time>},
+        }
+        self.calls = Counter({"GET /rest/api/2/search": 3, ...})
+
+        Args:
+            issues (int): How many issues to make up
+            latency (float): Seconds every request takes
+            error_rate (float): Share of the requests answered with a 503
+            rate_limit (float): Requests per second allowed, beyond that
+                requests get a 429 with Retry-After
+            page_size (int): Most issues a search returns, whatever asked
+            port (int): Port to listen on, 0 picks a free one
+
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self.issues = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._tokens = rate_limit or 0
+        self._refilled = monotonic()
+        self._next_worklog = count(1)
+        for index in range(issues):
+            issue_id = str(10000 + index)
+            self.issues[issue_id] = {
+                "id": issue_id,
+                "key": "PROJ-{}".format(index),
+                "summary": SUMMARIES[index % len(SUMMARIES)],
+                "status": IN_PROGRESS if index == 0 else TODO,
+                "timespent": 60 * index,
+                "updated": datetime.now().timestamp(),
+            }
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.server.daemon_threads = True
+        self.server.standin = self
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self.calls)
+
+    def handle(self, method, url, body):
+        """Return (status, JSON body, headers) for a request."""
+        parts = urlsplit(url)
+        with self._lock:
+            self.calls[endpoint(method, parts.path)] += 1
+        if self.latency:
+            sleep(self.latency)
+        try:
+            self._throttle()
+            if random() < self.error_rate:
+                raise Reply(503, {"errorMessages": ["Injected failure"]})
+            if not parts.path.startswith(API_PATH):
+                raise Reply(404)
+            route = parts.path[len(API_PATH):].rstrip("/")
+            query = {name: values[-1]
+                     for name, values in parse_qs(parts.query).items()}
+            return 200, self._route(method, route, query, body), {}
+        except Reply as reply:
+            return reply.status, reply.body, reply.headers
+
+    def _throttle(self):
+        if not self.rate_limit:
+            return
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self.rate_limit,
+                self._tokens + (now - self._refilled) * self.rate_limit
+            )
+            self._refilled = now
+            if self._tokens < 1:
+                wait = (1 - self._tokens) / self.rate_limit
+                raise Reply(429, {"errorMessages": ["Rate limit exceeded"]},
+                            {"Retry-After": str(math.ceil(wait))})
+            self._tokens -= 1
+
+    def _route(self, method, route, query, body):
+        if route == "serverInfo":
+            return {"baseUrl": self.url, "version": "8.20.0",
+                    "versionNumbers": [8, 20, 0], "deploymentType": "Server",
+                    "serverTitle": "Jira stand-in"}
+        if route == "field":
+            return [{"id": field, "name": field, "clauseNames": [field]}
+                    for field in FIELDS]
+        if route == "search":
+            return self._search(query)
+        match = re.fullmatch(r"issue/([^/]+)(?:/(transitions|worklog))?",
+                             route)
+        if not match:
+            raise Reply(404)
+        issue = self._find(match.group(1))
+        action = match.group(2)
+        if action is None and method == "GET":
+            return self._issue_json(issue)
+        if action == "transitions" and method == "GET":
+            return {"transitions": [
+                {"id": transition_id, "name": STATUS_NAMES[status_id],
+                 "to": {"id": status_id, "name": STATUS_NAMES[status_id]}}
+                for status_id, transition_id in TRANSITIONS.items()
+                if status_id != issue["status"]
+            ]}
+        if action == "transitions" and method == "POST":
+            transition_id = str(json.loads(body)["transition"]["id"])
+            targets = {value: key for key, value in TRANSITIONS.items()}
+            if transition_id not in targets:
+                raise Reply(400, {"errorMessages": ["Unknown transition"]})
+            with self._lock:
+                issue["status"] = targets[transition_id]
+                issue["updated"] = datetime.now().timestamp()
+            raise Reply(204)
+        if action == "worklog" and method == "POST":
+            seconds = int(json.loads(body)["timeSpentSeconds"])
+            with self._lock:
+                issue["timespent"] = (issue["timespent"] or 0) + seconds
+                issue["updated"] = datetime.now().timestamp()
+                worklog_id = next(self._next_worklog)
+            raise Reply(201, {"id": str(worklog_id), "issueId": issue["id"],
+                              "timeSpentSeconds": seconds})
+        raise Reply(405)
+
+    def _find(self, id_or_key):
+        issue = self.issues.get(id_or_key) or next(
+            (issue for issue in self.issues.values()
+             if issue["key"] == id_or_key), None)
+        if issue is None:
+            raise Reply(404, {"errorMessages": ["Issue does not exist"]})
+        return issue
+
+    def _search(self, query):
+        """Enough JQL for JiraAPI: status in (...) and updated >= -Nm."""
+        jql = query.get("jql", "")
+        issues = sorted(self.issues.values(), key=lambda issue: int(issue["id"]),
+                        reverse=True)
+        statuses = _STATUS_FILTER.search(jql)
+        if statuses:
+            wanted = {status.strip() for status in statuses.group(1).split(",")}
+            issues = [issue for issue in issues if issue["status"] in wanted]
+        updated = _UPDATED_FILTER.search(jql)
+        if updated:
+            since = datetime.now().timestamp() - int(updated.group(1)) * 60
+            issues = [issue for issue in issues if issue["updated"] >= since]
+        start_at = int(query.get("startAt", 0))
+        max_results = min(int(query.get("maxResults", 50)), self.page_size)
+        return {
+            "startAt": start_at,
+            "maxResults": max_results,
+            "total": len(issues),
+            "issues": [self._issue_json(issue)
+                       for issue in issues[start_at:start_at + max_results]],
+        }
+
+    def _issue_json(self, issue):
+        return {
+            "id": issue["id"],
+            "key": issue["key"],
+            "self": "{}{}issue/{}".format(self.url, API_PATH, issue["id"]),
+            "fields": {
+                "summary": issue["summary"],
+                "status": {"id": issue["status"],
+                           "name": STATUS_NAMES[issue["status"]]},
+                "timespent": issue["timespent"],
+                "project": {"id": PROJECT_ID, "key": "PROJ"},
+                "issuetype": {"id": "1", "name": "Task"},
+            },
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, so the client's connection pool is exercised
+    protocol_version = "HTTP/1.1"
+
+    def _serve(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, payload, headers = self.server.standin.handle(
+            self.command, self.path, body)
+        content = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+# button, seconds to let the outbox settle afterwards
+SCENARIO = (
+    ("next", 0.5),   # issue screen to selection
+    ("next", 0.5),   # preview the next issue
+    ("start", 0.5),  # pick it
+    ("start", 2),    # start it, two transitions go through the outbox
+    ("start", 2),    # stop it, a transition and a worklog
+    ("prev", 0.5),
+)
+
+
+def run_scenario(standin, rounds):
+    """Push the SCENARIO buttons rounds times, return a report per push."""
+    from core.base import Manager
+    from benchmarks.virtual_arduino import VirtualArduino
+
+    device = VirtualArduino().start()
+    workdir = tempfile.mkdtemp()
+    config = {
+        "serial_port": device.port,
+        "account_url": standin.url,
+        "username": "stand-in",
+        "token": "stand-in",
+        "project_id": PROJECT_ID,
+        "status": {"todo": TODO, "in_progress": IN_PROGRESS, "done": DONE},
+        "outbox_file": path.join(workdir, "outbox.jsonl"),
+    }
+    started = monotonic()
+    manager = Manager(config)
+    runner = threading.Thread(target=manager.run, daemon=True)
+    runner.start()
+    if not device.wait_frames(1, timeout=30):
+        raise RuntimeError("the host never sent a frame")
+    report = {"startup_s": monotonic() - started, "actions": []}
+
+    for _ in range(rounds):
+        for button, settle in SCENARIO:
+            calls = standin.snapshot()
+            frames = len(device.frame_times)
+            pushed = monotonic()
+            device.press(button)
+            shown = device.wait_frames(frames + 1, timeout=10)
+            screen_ms = ((device.frame_times[frames] - pushed) * 1000
+                         if shown else None)
+            sleep(settle)
+            report["actions"].append({
+                "button": button,
+                "screen_update_ms": screen_ms,
+                "http_calls": dict(standin.snapshot() - calls),
+            })
+
+    manager.stop()
+    runner.join()
+    manager.close()
+    device.stop()
+    for button in {button for button, _ in SCENARIO}:
+        actions = [action for action in report["actions"]
+                   if action["button"] == button]
+        timings = [action["screen_update_ms"] for action in actions
+                   if action["screen_update_ms"] is not None]
+        report.setdefault("summary", {})[button] = {
+            "pushes": len(actions),
+            "missed_screen_updates": len(actions) - len(timings),
+            "mean_screen_update_ms": (sum(timings) / len(timings)
+                                      if timings else None),
+            "http_calls_per_push": sum(
+                sum(action["http_calls"].values()) for action in actions
+            ) / len(actions),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--issues", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="share of requests failing with a 503")
+    parser.add_argument("--rate-limit", type=float,
+                        help="requests per second before answering 429")
+    parser.add_argument("--page-size", type=int, default=MAX_PAGE_SIZE,
+                        help="most issues returned by one search")
+    parser.add_argument("--scenario", action="store_true",
+                        help="run the load scenario instead of serving")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    standin = JiraStandIn(
+        issues=args.issues, latency=args.latency, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, page_size=args.page_size,
+        port=0 if args.scenario else args.port
+    ).start()
+    if not args.scenario:
+        print("Serving a Jira stand-in on {}".format(standin.url))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        standin.stop()
+        return 0
+
+    report = run_scenario(standin, args.rounds)
+    standin.stop()
+    print(json.dumps(report, indent=4))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of the display and scheduling hot paths.
+
+Usage: python benchmarks/suite.py [--save-baseline] [--threshold 0.2]
+
+Results are written to benchmarks/results.json. When a baseline exists at
+benchmarks/baseline.json (create one with --save-baseline) every benchmark
+is compared to it and the run fails if any got slower than the threshold.
+Baselines are machine specific, so keep them out of version control.
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+from os import path
+from timeit import Timer
+from unittest import mock
+
+BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import serial  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import core.base  # noqa: E402
+from core.issues import IssueSummary  # noqa: E402
+from display.animation import load_animation  # noqa: E402
+from display import base as display_base  # noqa: E402
+from display.base import DisplayIssue, DisplayText, image_to_hex  # noqa: E402
+from display.encoder import pack_image  # noqa: E402
+
+RESULTS_FILE = path.join(BASE_DIR, "benchmarks", "results.json")
+BASELINE_FILE = path.join(BASE_DIR, "benchmarks", "baseline.json")
+SUMMARIES = [
+    "Fix login redirect loop",
+    "Investigate intermittent timeouts on the payments webhook and add "
+    "retries with exponential backoff",
+    "Upgrade the reporting service to the new database driver, migrate the "
+    "connection pool settings and verify the nightly exports still finish "
+    "before the 6am deadline on the biggest customer accounts",
+    "As a user I want to export my invoices as CSV so that I can import "
+    "them into my accounting software without retyping every line, "
+    "including credit notes, partial refunds and multi currency totals",
+]
+TODO, IN_PROGRESS = "1", "3"
+
+
+def fake_issues(count):
+    return [
+        IssueSummary(str(10000 + index), "PROJ-{}".format(index),
+                     SUMMARIES[index % len(SUMMARIES)],
+                     IN_PROGRESS if index == 0 else TODO, 3600 + index)
+        for index in range(count)
+    ]
+
+
+class FakePage(list):
+    total = 0
+
+
+class FakeJira:
+    """Just enough of <JIRA> for JiraAPI, answering from memory."""
+
+    def __init__(self, *args, **kwargs):
+        self._session = mock.MagicMock()
+        self.issues = [
+            mock.MagicMock(id=issue.id, key=issue.key, fields=mock.MagicMock(
+                summary=issue.summary, timespent=issue.timespent,
+                status=mock.MagicMock(id=issue.status_id),
+                project=mock.MagicMock(id="1"),
+                issuetype=mock.MagicMock(id="1"),
+            ))
+            for issue in fake_issues(40)
+        ]
+
+    def search_issues(self, query, startAt=0, maxResults=50, **kwargs):
+        page = FakePage(self.issues[startAt:startAt + maxResults])
+        page.total = len(self.issues)
+        return page
+
+    def transitions(self, issue):
+        return [{"id": "11", "to": {"id": TODO}},
+                {"id": "21", "to": {"id": IN_PROGRESS}}]
+
+
+def fake_manager(workdir):
+    config = {
+        "serial_port": "loop://",
+        "project_id": "1",
+        "account_url": "https://jira.invalid",
+        "username": "",
+        "token": "",
+        "status": {"todo": TODO, "in_progress": IN_PROGRESS, "done": "4"},
+        "outbox_file": path.join(workdir, "outbox.jsonl"),
+    }
+    with mock.patch.object(core.base, "JIRA", FakeJira), \
+            mock.patch.object(core.base.serial, "Serial",
+                              lambda port, *args, **kwargs:
+                              serial.serial_for_url(port, timeout=0)):
+        return core.base.Manager(config)
+
+
+def gif_frames(name):
+    gif = Image.open(path.join(BASE_DIR, "images", name))
+    frames = []
+    for frame in range(gif.n_frames):
+        gif.seek(frame)
+        frames.append(pack_image(gif.copy().convert(mode="1")))
+    return frames
+
+
+def benchmarks(workdir):
+    """Yield (name, function, calls per timing) for every benchmark."""
+    issue = fake_issues(1)[0]
+    image = DisplayIssue(issue, "running", "12:34").image
+
+    def render_issue_cold():
+        display_base.issue_layer.cache_clear()
+        DisplayIssue(issue, "running", "12:34")
+
+    def render_text_cold():
+        display_base.text_layout.cache_clear()
+        for summary in SUMMARIES:
+            DisplayText("PROJ-1234: " + summary)
+
+    def timers_execute():
+        timers = core.base.Timers()
+        for index in range(1000):
+            if index % 2:
+                timers.add(-index / 1000, lambda: None, tag=index % 10)
+            else:
+                timers.add(1 + index / 1000, lambda: None, tag=index % 10,
+                           repeat=True)
+        for tag in range(0, 10, 3):
+            timers.remove_by_tag(tag)
+        timers.execute()
+
+    animation = load_animation(path.join(BASE_DIR, "images", "si.gif"))
+    manager = fake_manager(workdir)
+
+    def refresh_issues():
+        manager.api.expire_issues()
+        manager.refresh_issues()
+
+    yield "render DisplayIssue", lambda: DisplayIssue(issue, "running",
+                                                      "12:34"), 200
+    yield "render DisplayIssue cold", render_issue_cold, 100
+    yield "render DisplayText x4", lambda: [
+        DisplayText("PROJ-1234: " + summary) for summary in SUMMARIES
+    ], 100
+    yield "render DisplayText x4 cold", render_text_cold, 20
+    yield "pack_image", lambda: pack_image(image), 2000
+    yield "image_to_hex", lambda: image_to_hex(image), 200
+    yield "Timers.execute 1000 timers", timers_execute, 10
+    yield "screen saver frames si.gif", lambda: gif_frames("si.gif"), 5
+    yield "screen saver frames si.gif mapped", lambda: [
+        animation.frame(index) for index in range(len(animation))
+    ], 2000
+    yield "refresh_issues 40 issues", refresh_issues, 20
+    manager.close()
+
+
+def run(repeat=5):
+    """Best time per call of each benchmark, in microseconds."""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, function, number in benchmarks(workdir):
+            best = min(Timer(function).repeat(repeat=repeat, number=number))
+            results[name] = best / number * 1e6
+            print("{:<32} {:>12.1f} us".format(name, results[name]))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the benchmarks slower than baseline by more than threshold."""
+    regressions = []
+    for name, microseconds in sorted(results.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+        change = microseconds / before - 1
+        print("{:<32} {:>+8.1%}".format(name, change))
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown, 0.2 means 20%%")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    with open(RESULTS_FILE, "w") as results_file:
+        json.dump(results, results_file, indent=4, sort_keys=True)
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=4, sort_keys=True)
+        return 0
+    if not path.exists(BASELINE_FILE):
+        return 0
+    with open(BASELINE_FILE) as baseline_file:
+        regressions = compare(results, json.load(baseline_file),
+                              args.threshold)
+    if regressions:
+        print("Slower than baseline: {}".format(", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
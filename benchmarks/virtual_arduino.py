@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A virtual Arduino Nano speaking the core.ino protocol over a pty.
+
+Usage: python benchmarks/virtual_arduino.py [--presses 20] [--save-frames DIR]
+
+Runs a Manager from config.json against the virtual device, pushes buttons
+and prints the measurements as JSON. From code, point the "serial_port"
+config of a Manager at VirtualArduino().port.
+
+Like the firmware, the device parses 'I', 'D' and 'C' frames, answers
+"end_image" or "resync" and sends "prev", "next", "start" and "reset". It
+also takes the baud rate handshake, the checked packets of the framed
+protocol and the request to leave it. Input is consumed at the wire speed
+of the current baud rate, and noise can flip bits of it. The firmware
+blocks during the 200 ms delay after a button push and while it refreshes
+the display. Bytes arriving meanwhile fill its 64 byte receive buffer, and
+whatever does not fit is lost, as on the board.
+"""
+
+import argparse
+import binascii
+import json
+import os
+import random
+import select
+import sys
+import threading
+import tty
+from collections import deque
+from os import path
+from time import monotonic, sleep
+
+BASE_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from PIL import Image  # noqa: E402
+
+from core.profiling import PERCENTILES, percentile  # noqa: E402
+from display.base import BaseDisplay  # noqa: E402
+from display.encoder import (  # noqa: E402
+    BAUD_RATE, BAUD_RATES, COMPRESSED_COMMAND, DELTA_COMMAND, FRAME_START,
+    HANDSHAKE_COMMAND, IMAGE_COMMAND, PING_COMMAND, UNFRAMED_COMMAND,
+    wire_time
+)
+
+BUTTONS = ("prev", "next", "start", "reset")
+BITMAP_SIZE = BaseDisplay.size[0] * BaseDisplay.size[1] // 8
+RX_BUFFER_SIZE = 64  # HardwareSerial receive buffer of the Nano
+SERIAL_TIMEOUT = 1  # seconds, Stream.readBytes default
+BUTTON_DELAY = 0.2  # seconds, the delay(200) after a push
+DISPLAY_TIME = 0.02  # seconds, pushing the buffer to the SSD1306 over I2C
+POLL_INTERVAL = 0.005  # seconds
+PING_TIMEOUT = 1  # seconds the firmware waits for a ping at a new rate
+MAX_PAYLOAD = BITMAP_SIZE + 8
+
+
+class VirtualArduino:
+
+    def __init__(self, baud_rate=BAUD_RATE, save_dir=None,
+                 button_delay=BUTTON_DELAY, display_time=DISPLAY_TIME,
+                 max_baud_rate=BAUD_RATES[-1], noise=0):
+        """Device definition, started with start.
+
+        self.latencies = [<seconds from button push to the next frame>, ...]
+        self.frame_times = [<monotonic time a frame was shown>, ...]
+
+        Args:
+            baud_rate (int): Wire speed the input is paced at
+            save_dir (str): Save every frame shown there as a PNG
+            button_delay (float): Firmware delay after a button push
+            display_time (float): Firmware time to refresh the display
+            max_baud_rate (int): Fastest rate the handshake may pick
+            noise (float): Chance of a flipped bit in every byte received
+
+        """
+        self.baud_rate = baud_rate
+        self.save_dir = save_dir
+        self.button_delay = button_delay
+        self.display_time = display_time
+        self.max_baud_rate = max_baud_rate
+        self.noise = noise
+        self.image_buffer = bytearray(BITMAP_SIZE)
+        self.latencies = []
+        self.frame_times = []
+        self.frame_bytes = 0
+        self.incomplete_frames = 0
+        self.resyncs = 0
+        self.dropped_bytes = 0
+        self.ignored_bytes = 0
+        self.flipped_bytes = 0
+        self.acks = 0
+        self.naks = 0
+        self.started = None
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._rx = bytearray()
+        self._wire_clock = 0
+        self._consumed = 0
+        self._framed_only = False
+        self._need_full_frame = True
+        self._last_sequence = 0
+        self._framing = False
+        self._remaining = 0
+        self._crc = 0
+        self._presses = deque()
+        self._waiting = []
+        self._frame_shown = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        if save_dir:
+            os.makedirs(save_dir, exist_ok=True)
+
+    def start(self):
+        self.started = monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def press(self, button):
+        """Push and release a button, "reset" reboots the device."""
+        if button not in BUTTONS:
+            raise ValueError("unknown button {}".format(button))
+        self._presses.append((button, monotonic()))
+
+    def wait_frames(self, count, timeout=None):
+        """Block until count frames were shown in total, False on timeout."""
+        with self._frame_shown:
+            return self._frame_shown.wait_for(
+                lambda: len(self.frame_times) >= count, timeout)
+
+    def stats(self):
+        elapsed = monotonic() - self.started if self.started else 0
+        latencies = sorted(self.latencies)
+        stats = {
+            "frames": len(self.frame_times),
+            "frames_per_second": (len(self.frame_times) / elapsed
+                                  if elapsed else 0),
+            "frame_bytes": self.frame_bytes,
+            "incomplete_frames": self.incomplete_frames,
+            "resyncs": self.resyncs,
+            "dropped_bytes": self.dropped_bytes,
+            "ignored_bytes": self.ignored_bytes,
+            "flipped_bytes": self.flipped_bytes,
+            "acks": self.acks,
+            "naks": self.naks,
+            "baud_rate": self.baud_rate,
+            "presses": len(latencies),
+            "latency_max_ms": latencies[-1] * 1000 if latencies else 0,
+        }
+        for percent in PERCENTILES:
+            stats["latency_p{}_ms".format(percent)] = percentile(
+                latencies, percent) * 1000
+        return stats
+
+    def _run(self):
+        self._println("reset")
+        while not self._stopped.is_set():
+            self._handle_buttons()
+            command = self._read(1, POLL_INTERVAL)
+            if not command:
+                continue
+            start = self._consumed - 1
+            if self._framed_only and command in (
+                    IMAGE_COMMAND, DELTA_COMMAND, COMPRESSED_COMMAND,
+                    HANDSHAKE_COMMAND):
+                self.ignored_bytes += 1
+            elif command[0] == FRAME_START:
+                self._read_frame(start)
+            elif command == HANDSHAKE_COMMAND:
+                self._negotiate_baud_rate()
+            elif command == PING_COMMAND:
+                self._println("pong")
+                self._framed_only = True
+            elif command == UNFRAMED_COMMAND[:1]:
+                if self._read(1, SERIAL_TIMEOUT) == UNFRAMED_COMMAND[1:]:
+                    self.baud_rate = BAUD_RATE
+                    self._framed_only = False
+            elif command == IMAGE_COMMAND:
+                data = self._read(BITMAP_SIZE, SERIAL_TIMEOUT)
+                self.image_buffer[:len(data)] = data
+                if len(data) < BITMAP_SIZE:
+                    # the firmware does not check, it shows what it got
+                    self.incomplete_frames += 1
+                self._println("end_image")
+                self._show(self._consumed - start)
+            elif command in (DELTA_COMMAND, COMPRESSED_COMMAND):
+                if command == DELTA_COMMAND:
+                    complete = self._read_delta()
+                else:
+                    complete = self._read_packbits()
+                if complete:
+                    self._println("end_image")
+                    self._show(self._consumed - start)
+                else:
+                    self.resyncs += 1
+                    self._println("resync")
+            else:
+                self.ignored_bytes += 1
+
+    def _handle_buttons(self):
+        """Report the pushes since the last loop, like loop() does."""
+        if not self._presses:
+            return
+        presses = []
+        while self._presses:
+            presses.append(self._presses.popleft())
+        if any(button == "reset" for button, _ in presses):
+            self._reboot()
+            return
+        self._busy(self.button_delay)
+        for button, pushed in presses:
+            self._waiting.append(pushed)
+            self._println(button)
+
+    def _reboot(self):
+        self._rx.clear()
+        self._drain(sys.maxsize)
+        self._waiting = []
+        self.baud_rate = BAUD_RATE
+        self._framed_only = False
+        self._need_full_frame = True
+        self._println("reset")
+
+    def _negotiate_baud_rate(self):
+        code = self._read(1, SERIAL_TIMEOUT)
+        if not code:
+            return
+        rates = [rate for rate in BAUD_RATES if rate <= self.max_baud_rate]
+        rate = rates[min(code[0], len(rates) - 1)]
+        self._println("baud {}".format(rate))
+        self.baud_rate = rate
+        deadline = monotonic() + PING_TIMEOUT
+        while monotonic() < deadline:
+            if self._read(1, deadline - monotonic()) == PING_COMMAND:
+                self._println("pong")
+                self._framed_only = True
+                return
+        self.baud_rate = BAUD_RATE
+
+    def _read_frame(self, start):
+        """A checked packet, see readFrame in core.ino."""
+        header = self._read(4, SERIAL_TIMEOUT)
+        if len(header) != 4:
+            return
+        sequence, command, length = header[0], header[1:2], header[2:]
+        self._remaining = int.from_bytes(length, "big")
+        if self._remaining > MAX_PAYLOAD:
+            self._nak(sequence)
+            return
+        self._framing = True
+        self._crc = binascii.crc_hqx(header, 0xFFFF)
+        complete = False
+        if command == IMAGE_COMMAND:
+            data = self._read_input(BITMAP_SIZE)
+            self.image_buffer[:len(data)] = data
+            complete = len(data) == BITMAP_SIZE
+        elif command == COMPRESSED_COMMAND:
+            complete = self._read_packbits()
+        elif (command == DELTA_COMMAND and not self._need_full_frame
+              and sequence == (self._last_sequence + 1) % 256):
+            complete = self._read_delta()
+        while self._remaining and self._read_input(1):
+            pass
+        self._framing = False
+        crc = self._read(2, SERIAL_TIMEOUT)
+        if (complete and not self._remaining
+                and crc == self._crc.to_bytes(2, "big")):
+            self._last_sequence = sequence
+            if command != DELTA_COMMAND:
+                self._need_full_frame = False
+            self._show(self._consumed - start)
+            self.acks += 1
+            self._println("ack {}".format(sequence))
+        else:
+            self._nak(sequence)
+
+    def _nak(self, sequence):
+        self._framing = False
+        self._need_full_frame = True
+        self.naks += 1
+        self._println("nak {}".format(sequence))
+
+    def _read_input(self, size):
+        """Image data, inside a packet limited to its payload and CRC'd."""
+        if self._framing and size > self._remaining:
+            return b""
+        data = self._read(size, SERIAL_TIMEOUT)
+        if self._framing:
+            self._remaining -= len(data)
+            self._crc = binascii.crc_hqx(data, self._crc)
+        return data
+
+    def _read_delta(self):
+        ranges = self._read_input(1)
+        if len(ranges) != 1:
+            return False
+        ok = True
+        for _ in range(ranges[0]):
+            header = self._read_input(3)
+            if len(header) != 3:
+                return False
+            offset = int.from_bytes(header[:2], "big")
+            length = header[2]
+            data = self._read_input(length)
+            if offset + length > BITMAP_SIZE:
+                ok = False  # read anyway, like the firmware
+            else:
+                self.image_buffer[offset:offset + len(data)] = data
+            if len(data) != length:
+                return False
+        return ok
+
+    def _read_packbits(self):
+        position = 0
+        while position < BITMAP_SIZE:
+            header = self._read_input(1)
+            if not header:
+                return False
+            header = header[0]
+            if header < 128:
+                length = header + 1
+                if position + length > BITMAP_SIZE:
+                    return False
+                data = self._read_input(length)
+                self.image_buffer[position:position + len(data)] = data
+                if len(data) != length:
+                    return False
+                position += length
+            elif header > 128:
+                length = 257 - header
+                if position + length > BITMAP_SIZE:
+                    return False
+                value = self._read_input(1)
+                if not value:
+                    return False
+                self.image_buffer[position:position + length] = value * length
+                position += length
+        return True
+
+    def _show(self, size):
+        now = monotonic()
+        self.frame_bytes += size
+        for pushed in self._waiting:
+            self.latencies.append(now - pushed)
+        self._waiting = []
+        if self.save_dir:
+            Image.frombytes("1", BaseDisplay.size, bytes(self.image_buffer)).save(
+                path.join(self.save_dir,
+                          "frame_{:05d}.png".format(len(self.frame_times)))
+            )
+        with self._frame_shown:
+            self.frame_times.append(now)
+            self._frame_shown.notify_all()
+        self._busy(self.display_time)
+
+    def _read(self, size, timeout):
+        """Like Serial.readBytes: up to size bytes, fewer on timeout."""
+        deadline = monotonic() + timeout
+        data = bytearray()
+        while len(data) < size:
+            if not self._rx and not self._receive(deadline - monotonic()):
+                break
+            take = min(size - len(data), len(self._rx))
+            data += self._rx[:take]
+            del self._rx[:take]
+        self._consumed += len(data)
+        return bytes(data)
+
+    def _receive(self, timeout):
+        """Move bytes from the pty into the receive buffer at wire speed."""
+        if timeout <= 0 or not select.select([self._master], [], [],
+                                             timeout)[0]:
+            return False
+        data = self._flip(os.read(self._master, RX_BUFFER_SIZE))
+        self._wire_clock = (max(self._wire_clock, monotonic())
+                            + wire_time(len(data), self.baud_rate))
+        sleep(max(self._wire_clock - monotonic(), 0))
+        self._rx += data
+        return True
+
+    def _busy(self, seconds):
+        """Block like the firmware, losing what overflows the receive buffer."""
+        sleep(seconds)
+        arrived = self._drain(int(seconds / wire_time(1, self.baud_rate)))
+        room = max(RX_BUFFER_SIZE - len(self._rx), 0)
+        self._rx += arrived[:room]
+        self.dropped_bytes += max(len(arrived) - room, 0)
+        self._wire_clock = monotonic()
+
+    def _flip(self, data):
+        if not self.noise:
+            return data
+        data = bytearray(data)
+        for index in range(len(data)):
+            if random.random() < self.noise:
+                data[index] ^= 1 << random.randrange(8)
+                self.flipped_bytes += 1
+        return bytes(data)
+
+    def _drain(self, size):
+        """Up to size bytes waiting in the pty, without blocking."""
+        data = bytearray()
+        while len(data) < size and select.select([self._master], [], [], 0)[0]:
+            chunk = self._flip(os.read(self._master,
+                                       min(size - len(data), 4096)))
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+
+    def _println(self, message):
+        os.write(self._master, message.encode() + b"\r\n")
+
+
+def main():
+    from core.base import Manager
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--config", default=path.join(BASE_DIR, "config.json"))
+    parser.add_argument("--presses", type=int, default=20)
+    parser.add_argument("--buttons", default="next,prev",
+                        help="comma separated buttons to push in turn")
+    parser.add_argument("--interval", type=float, default=1,
+                        help="seconds between pushes")
+    parser.add_argument("--noise", type=float, default=0,
+                        help="chance of a flipped bit in every byte")
+    parser.add_argument("--save-frames", metavar="DIR",
+                        help="save every frame shown as a PNG in DIR")
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    device = VirtualArduino(save_dir=args.save_frames,
+                            noise=args.noise).start()
+    config["serial_port"] = device.port
+    manager = Manager(config)
+    runner = threading.Thread(target=manager.run, daemon=True)
+    runner.start()
+    if not device.wait_frames(1, timeout=30):
+        print("The host never sent a frame")
+        return 1
+
+    buttons = args.buttons.split(",")
+    for index in range(args.presses):
+        device.press(buttons[index % len(buttons)])
+        sleep(args.interval)
+
+    print(json.dumps(device.stats(), indent=4))
+    manager.stop()
+    runner.join()
+    manager.close()
+    device.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
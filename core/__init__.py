@@ -2,21 +2,112 @@
 # -*- coding: utf-8 -*-
 """Every time you don't DOC your code god kills a kitten."""
 
+import atexit
+import os
+import queue
+import sys
+import threading
 from datetime import datetime
 from os import path
+from time import monotonic
 
 BASE_DIR = path.dirname(path.abspath(__file__))
+LOG_DIR = path.join(BASE_DIR, "../logs")
+LOG_QUEUE_SIZE = 10000  # records, more are dropped rather than block
+LOG_BATCH_SIZE = 100  # records written with one open
+LOG_FLUSH_INTERVAL = 1  # seconds a record may wait for its batch
+LOG_MAX_BYTES = 1024 * 1024  # rotate a log file past this size
+LOG_BACKUP_COUNT = 3  # rotated files kept, error.log.1 being the newest
+REPEAT_WINDOW = 60  # seconds an identical error is not logged again
+
+# The main loop only formats and queues log records, a background thread
+# appends them to the files in batches.
+_records = queue.Queue(LOG_QUEUE_SIZE)
+_repeated = {}  # error message -> [monotonic time logged, times suppressed]
+_lock = threading.Lock()
+_writer = None
 
 
 def error_log(msg):
-    log = "{} - {}\n".format(datetime.now(), msg)
-    print(log)
-    with open(path.join(BASE_DIR, "../logs/error.log"), "a") as f:
-        f.write(log)
+    msg = str(msg)
+    now = monotonic()
+    with _lock:
+        seen = _repeated.get(msg)
+        if seen and now - seen[0] < REPEAT_WINDOW:
+            # like a tight retry loop failing the same way, once is enough
+            seen[1] += 1
+            return
+        if len(_repeated) > LOG_QUEUE_SIZE:
+            _repeated.clear()
+        _repeated[msg] = [now, 0]
+    if seen and seen[1]:
+        msg = "{} (repeated {} more times)".format(msg, seen[1])
+    _log("error.log", msg)
 
 
 def info_log(msg):
+    _log("info.log", msg)
+
+
+def flush_logs():
+    """Block until every queued log record is on disk."""
+    if _writer is not None:
+        _records.join()
+
+
+def _log(filename, msg):
+    global _writer
     log = "{} - {}\n".format(datetime.now(), msg)
     print(log)
-    with open(path.join(BASE_DIR, "../logs/info.log"), "a") as f:
-        f.write(log)
+    if _writer is None:
+        with _lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_logs, daemon=True)
+                _writer.start()
+    try:
+        _records.put_nowait((filename, log))
+    except queue.Full:
+        pass  # the console still got it, never stall the caller on disk
+
+
+def _write_logs():
+    while True:
+        batch = [_records.get()]
+        deadline = monotonic() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            try:
+                batch.append(_records.get(timeout=max(
+                    deadline - monotonic(), 0)))
+            except queue.Empty:
+                break
+        try:
+            _write_batch(batch)
+        except OSError as exc:
+            print("Could not write logs: {}".format(exc), file=sys.stderr)
+        for _ in batch:
+            _records.task_done()
+
+
+def _write_batch(batch):
+    lines = {}
+    for filename, log in batch:
+        lines.setdefault(filename, []).append(log)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    for filename, logs in lines.items():
+        filepath = path.join(LOG_DIR, filename)
+        if (path.exists(filepath)
+                and path.getsize(filepath) >= LOG_MAX_BYTES):
+            _rotate(filepath)
+        with open(filepath, "a") as f:
+            f.writelines(logs)
+
+
+def _rotate(filepath):
+    for index in range(LOG_BACKUP_COUNT - 1, 0, -1):
+        older = "{}.{}".format(filepath, index)
+        if path.exists(older):
+            os.replace(older, "{}.{}".format(filepath, index + 1))
+    os.replace(filepath, filepath + ".1")
+
+
+atexit.register(flush_logs)
@@ -1,19 +1,58 @@
+import asyncio
 import atexit
+import heapq
 import json
+import math
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from time import sleep
+from functools import partial
+from itertools import count
+from os import path
+from time import monotonic
 import traceback
 
 import serial
 from jira import JIRA
+from PIL import Image
+from requests.adapters import HTTPAdapter
 
-from core import info_log
-from display.base import DisplayIssue, DisplayText
+from core import BASE_DIR, error_log, info_log
+from core.http_stats import HttpStats
+from core.issues import IssueStore, IssueSummary
+from core.outbox import OUTBOX_FILE, Outbox
+from core.profiling import Profiler
+from display.animation import Playback, load_animation
+from display.base import BaseDisplay, DisplayIssue, DisplayText
+from display.encoder import (
+    BAUD_RATE, BAUD_RATES, PING_COMMAND, UNFRAMED_COMMAND, EncodedFrame,
+    FrameLink, FramedLink, handshake, pack_image
+)
+
+
+ISSUE_FIELDS = "summary,status,timespent,project,issuetype"
+ISSUES_PAGE_SIZE = 50
+ISSUE_CACHE_TTL = 60  # seconds
+ISSUE_FULL_SYNC_INTERVAL = 15 * 60  # seconds
+JIRA_POOL_SIZE = 4
+HTTP_TRACE_FILE = path.join(BASE_DIR, "../logs/http_traces.jsonl")
+PROFILING_FILE = path.join(BASE_DIR, "../logs/profiling.json")
+SERIAL_TIMEOUT_STEP = 0.05  # seconds
+START_RETRY_DELAY = 5  # seconds
+HANDSHAKE_TIMEOUT = 1.5  # seconds, longer than the firmware waits for a ping
+IDLE_ANIMATION = path.join(BASE_DIR, "../images/si.gif")
+NO_PROFILER = Profiler()  # disabled, times nothing
 
 
 class JiraAPI:
 
-    def __init__(self, config):
+    def __init__(self, config, adapter=None):
+        """Jira client for the login and project in config.
+
+        Pass a shared <HTTPAdapter> as adapter to pool connections with
+        other clients, see JiraClients.
+        """
         self.config = config
 
         self.todo_status = self.config["status"]["todo"]
@@ -28,29 +67,113 @@ class JiraAPI:
                 self.config["token"]
             )
         )
+        # keep a few connections alive for the worker threads sharing it
+        adapter = adapter or HTTPAdapter(pool_connections=JIRA_POOL_SIZE,
+                                         pool_maxsize=JIRA_POOL_SIZE)
+        self.jira_api._session.mount("https://", adapter)
+        self.jira_api._session.mount("http://", adapter)
+
+        http_config = self.config.get("http_stats", {})
+        self.http_stats = HttpStats(
+            self.jira_api._session,
+            trace_file=http_config.get("trace_file", HTTP_TRACE_FILE),
+            sample_rate=http_config.get("sample_rate", 0.01)
+        )
+        if http_config.get("enabled"):
+            self.http_stats.enable()
+        self.cache_ttl = self.config.get("issue_cache_ttl", ISSUE_CACHE_TTL)
+        self.full_sync_interval = self.config.get("issue_full_sync_interval",
+                                                  ISSUE_FULL_SYNC_INTERVAL)
+        self._issue_cache = IssueStore()
+        self._last_sync = None
+        self._last_full_sync = None
+        self._cache_lock = threading.RLock()
+        self._transitions = {}
+
         self.current_issue = None
         self.get_current_issue()
+        self.warm_transitions()
 
     def get_current_issue(self):
         self.current_issue = next(
-            (issue for issue in self.get_my_issues(self.in_progress_status)),
+            (issue for issue in self.my_issues(self.in_progress_status)),
             None
         )
         return self.current_issue
 
+    def my_issues(self, *status_ids):
+        """My todo and in progress issues from a local IssueStore.
+
+        Once the cache is older than cache_ttl only the issues updated since
+        the last sync are fetched and merged in. Every full_sync_interval
+        the whole list is fetched again to catch deletions and reassignments.
+
+        Args:
+            status_ids (str): Optional "todo" and "in_progress" ids filter
+
+        """
+        with self._cache_lock:
+            self._sync()
+            issues = sorted(self._issue_cache,
+                            key=lambda issue: int(issue.id), reverse=True)
+        if status_ids:
+            issues = [i for i in issues if i.status_id in status_ids]
+        return issues
+
+    def my_issues_by_key(self):
+        """Same as my_issues, sorted by issue key."""
+        with self._cache_lock:
+            self._sync()
+            return self._issue_cache.sorted()
+
+    def _sync(self):
+        """Bring the IssueStore up to date, with _cache_lock held."""
+        tracked = (self.in_progress_status, self.todo_status)
+        now = monotonic()
+        if (self._last_full_sync is None
+                or now - self._last_full_sync >= self.full_sync_interval):
+            self._issue_cache = IssueStore(self.get_my_issues(*tracked))
+            self._last_sync = self._last_full_sync = now
+        elif now - self._last_sync >= self.cache_ttl:
+            # JQL dates have minute resolution, overlap by a minute
+            minutes = int((now - self._last_sync) / 60) + 2
+            for issue in self.get_my_issues(updated_within=minutes):
+                if issue.status_id in tracked:
+                    self._issue_cache.put(issue)
+                else:
+                    self._issue_cache.remove(issue.id)
+            self._last_sync = now
+
+    def expire_issues(self):
+        """Make the next my_issues call sync with Jira."""
+        with self._cache_lock:
+            if self._last_sync is not None:
+                self._last_sync -= self.cache_ttl
+
     def get_issue(self, issue_key):
-        return self.jira_api.issue(issue_key)
+        return IssueSummary.from_issue(
+            self.jira_api.issue(issue_key, fields=ISSUE_FIELDS)
+        )
+
+    def get_my_issues(self, *status_ids, updated_within=None,
+                      page_size=ISSUES_PAGE_SIZE):
+        """Get all my issues, optionally filtered by status, page by page.
 
-    def get_my_issues(self, status_id=None):
-        """Get all my issues of filter by status.
+        Only the fields the display uses are requested and pages are
+        fetched lazily, so stopping early saves the remaining round trips.
 
         Args:
-            status (str): Options are "todo", "in_progress" and "done"
+            status_ids (str): Any of the "todo", "in_progress" and "done" ids
+            updated_within (int): Only issues updated in the last minutes
 
         """
         status_filter = ""
-        if status_id:
-            status_filter = " and status = {status}".format(status=status_id)
+        if status_ids:
+            status_filter = " and status in ({statuses})".format(
+                statuses=", ".join(status_ids)
+            )
+        if updated_within:
+            status_filter += " and updated >= -{}m".format(updated_within)
 
         query = (
             'assignee = currentUser() '
@@ -60,36 +183,84 @@ class JiraAPI:
             project_id=self.project_id,
             status_filter=status_filter
         )
-        return list(self.jira_api.search_issues(query))
+        start_at = 0
+        while True:
+            page = self.jira_api.search_issues(
+                query,
+                startAt=start_at,
+                maxResults=page_size,
+                fields=ISSUE_FIELDS
+            )
+            for issue in page:
+                yield IssueSummary.from_issue(issue)
+            start_at += len(page)
+            if not page or start_at >= page.total:
+                return
 
     def change_status(self, issue, status_id):
         """Change an issue's status.
 
         Args:
-            issue: <JIRA Issue> object
+            issue: <IssueSummary> object
             status (str): Options are "todo", "in_progress" and "done"
 
         """
-        if issue.fields.status.id == status_id:
+        if issue.status_id == status_id:
             return
 
-        resolution_id = next(
-            resolution["id"]
-            for resolution in self.jira_api.transitions(issue)
-            if resolution["to"]["id"] == status_id
-        )
-        info_log("Changing state of task {} to {}".format(issue, resolution_id))
-        self.jira_api.transition_issue(issue, resolution_id)
+        workflow_key = self._workflow_key(issue)
+        try:
+            transitions = self.get_transitions(issue)
+            if (status_id not in transitions
+                    and workflow_key in self._transitions):
+                # cached before the workflow changed, ask Jira once more
+                self._transitions.pop(workflow_key)
+                transitions = self.get_transitions(issue)
+            resolution_id = transitions[status_id]
+            info_log("Changing state of task {} to {}".format(
+                issue, resolution_id))
+            self.jira_api.transition_issue(issue.id, resolution_id)
+        except Exception:
+            # the workflow may have changed, look it up again next time
+            self._transitions.pop(workflow_key, None)
+            raise
+        self._cached_status(issue, status_id)
+
+    def get_transitions(self, issue):
+        """Map of target status id to transition id for issue.
+
+        Transitions depend only on the workflow, so they are cached per
+        (project, issue type, current status).
+        """
+        workflow_key = self._workflow_key(issue)
+        transitions = self._transitions.get(workflow_key)
+        if transitions is None:
+            transitions = {
+                resolution["to"]["id"]: resolution["id"]
+                for resolution in self.jira_api.transitions(issue.id)
+            }
+            if None not in workflow_key:
+                self._transitions[workflow_key] = transitions
+        return transitions
+
+    def warm_transitions(self):
+        """Load the transitions of every workflow state my issues are in."""
+        for issue in self.my_issues():
+            self.get_transitions(issue)
+
+    @staticmethod
+    def _workflow_key(issue):
+        return (issue.project_id, issue.issuetype_id, issue.status_id)
 
     def start_issue(self, issue):
         """Change issue state to 'in progress' and any other in progress to 'todo'.
 
         Args:
-            issue: <JIRA Issue> object
+            issue: <IssueSummary> object
 
         """
         info_log("Starting task {}".format(issue))
-        for in_progress in self.get_my_issues(self.in_progress_status):
+        for in_progress in self.my_issues(self.in_progress_status):
             if not in_progress.id == issue.id:
                 self.change_status(in_progress, self.todo_status)
         self.change_status(issue, self.in_progress_status)
@@ -100,6 +271,70 @@ class JiraAPI:
         info_log("Add {} seconds to worklog to {}".format(seconds, issue))
         self.jira_api.add_worklog(issue.id, adjustEstimate="auto", timeSpentSeconds=seconds)
 
+    def track_time(self, issue, seconds):
+        """Count worklog time locally before Jira has it."""
+        seconds = max(int(seconds), 60)
+        with self._cache_lock:
+            cached = self._issue_cache.get(issue.id)
+            for tracked in {id(issue): issue, id(cached): cached}.values():
+                if tracked:
+                    tracked.timespent = (tracked.timespent or 0) + seconds
+
+    def find_issue(self, issue_key):
+        """Issue from the cache, or from Jira if it is not cached."""
+        with self._cache_lock:
+            issue = self._issue_cache.by_key.get(issue_key)
+        return issue or self.get_issue(issue_key)
+
+    def _cached_status(self, issue, status_id):
+        """Apply a transition we just made to the cached issue."""
+        with self._cache_lock:
+            cached = self._issue_cache.get(issue.id)
+            if not cached:
+                return
+            if status_id in (self.in_progress_status, self.todo_status):
+                cached.status_id = status_id
+            else:
+                self._issue_cache.remove(issue.id)
+
+
+class JiraClients:
+
+    def __init__(self, pool_size=JIRA_POOL_SIZE):
+        """JiraAPI instances shared by the devices of one host.
+
+        self.clients = {
+            (<account url>, <username>, <project id>, ...): <JiraAPI>,
+        }
+
+        Devices with the same login and project share one client, with its
+        issue and transitions caches. All clients send through one pooled
+        HTTPAdapter, which only keeps connections and leaves authentication
+        to each client's session. Clients are created on first use, and a
+        slow login only holds up the devices waiting for that client.
+        """
+        self.adapter = HTTPAdapter(pool_connections=JIRA_POOL_SIZE,
+                                   pool_maxsize=pool_size)
+        self.clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, config):
+        key = (config["account_url"], config["username"], config["token"],
+               config["project_id"],
+               tuple(sorted(config["status"].items())))
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            api = self.clients.get(key)
+            if api is None:
+                api = self.clients[key] = JiraAPI(config, adapter=self.adapter)
+        return api
+
+    def all(self):
+        with self._lock:
+            return list(self.clients.values())
+
 
 class Display:
 
@@ -110,33 +345,38 @@ class Display:
         self.start_time = datetime.now()
         self.issue_preview = None
         self.bitmap = None
+        self.frame = None  # <EncodedFrame> of bitmap, when encoded ahead
         self.current_screen = 'splash'
         self._image = None
         self.blinking = False
         self.blink_colon = False
+        self.status_override = None
         self._manager = manager
 
+    @property
+    def status(self):
+        """Status id on screen, ahead of Jira while a change is queued."""
+        return self.status_override or self.issue.status_id
+
     def register_time(self):
-        if self.issue and self.issue.fields.status.id == self.in_progress_status:
+        if self.issue and self.status == self.in_progress_status:
             delta = (datetime.now() - self.start_time).total_seconds()
-            self._manager.api.add_time(self.issue, delta)
-            self.issue = self._manager.api.get_issue(self.issue.key)
-            self._manager.refresh_issues()
+            self._manager.run_blocking(self._manager.log_time, self.issue,
+                                       delta)
             self.start_time = datetime.now()
 
     def update(self):
         if self.current_screen == 'issue_selection':
-            if not self.issue_preview:
-                issue_text = "You do not have any tasks"
-            else:
-                issue_text = "{}: {}".format(self.issue_preview.key,
-                                             self.issue_preview.fields.summary)
-            self._image = DisplayText(issue_text).image
+            self._image = None
+            self.frame = self._manager.selection_frames.get(
+                self.issue_preview, self._manager.profiler)
+            self.bitmap = self.frame.bitmap
+            return
 
         elif self.current_screen == "issue":
-            if self.issue.fields.status.id == self.in_progress_status:
+            if self.status == self.in_progress_status:
                 state = "running"
-                elapsed = self.issue.fields.timespent or 0
+                elapsed = self.issue.timespent or 0
                 elapsed = (datetime.now() + timedelta(seconds=elapsed)) - self.start_time
                 elapsed = elapsed.total_seconds()
                 if (datetime.now() - self.start_time).total_seconds() >= 30 * 60:
@@ -154,13 +394,103 @@ class Display:
             else:
                 state = "paused"
                 clock = None
-                self._manager.timers.remove_by_tag("update_display")
-            self._image = DisplayIssue(self.issue, state, clock,
-                                       inversed_colors=self.blinking).image
+                self._manager.timers.remove_by_tag("display_update")
+            with self._manager.profiler.measure("render"):
+                self._image = DisplayIssue(self.issue, state, clock,
+                                           inversed_colors=self.blinking).image
+            with self._manager.profiler.measure("encode"):
+                self.bitmap = pack_image(self._image)
+            self.frame = None
 
     def save_file(self, filename):
         if self._image:
             self._image.save(filename)
+        elif self.bitmap:
+            Image.frombytes('1', BaseDisplay.size, self.bitmap).save(filename)
+
+
+class SelectionFrames:
+
+    def __init__(self, compress=True):
+        """Issue selection frames, encoded ahead of time on a worker thread.
+
+        self.frames = {
+            <issue id>: (<text>, <EncodedFrame>),
+            None: ("You do not have any tasks", <EncodedFrame>),
+        }
+
+        An entry is rendered again whenever its issue text changes. Next to
+        its full frame it keeps the deltas from its neighbours in the issue
+        list, what is on screen before a left or right push shows it.
+        """
+        self.compress = compress
+        self.frames = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def text(issue):
+        if not issue:
+            return "You do not have any tasks"
+        return "{}: {}".format(issue.key, issue.summary)
+
+    def get(self, issue, profiler=NO_PROFILER):
+        """Return the <EncodedFrame> for issue, rendering it if needed.
+
+        A frame that is not ready yet is timed as render and encode.
+        """
+        issue_id = issue.id if issue else None
+        text = self.text(issue)
+        with self._lock:
+            entry = self.frames.get(issue_id)
+        if entry and entry[0] == text:
+            return entry[1]
+        with profiler.measure("render"):
+            image = DisplayText(text).image
+        with profiler.measure("encode"):
+            encoded = EncodedFrame(pack_image(image), self.compress)
+        with self._lock:
+            self.frames[issue_id] = (text, encoded)
+        return encoded
+
+    def prerender(self, issues):
+        """Render the frames of issues in background, dropping stale ones."""
+        self._queue.put(list(issues))
+
+    def stop(self):
+        self._queue.put(None)
+
+    def _work(self):
+        while True:
+            issues = self._queue.get()
+            if issues is None:
+                return
+            self.get(None)
+            frames = [self.get(issue) for issue in issues]
+            for index, frame in enumerate(frames):
+                frame.encode_deltas((
+                    frames[index - 1].bitmap,
+                    frames[(index + 1) % len(frames)].bitmap,
+                ))
+            current = {issue.id for issue in issues}
+            with self._lock:
+                for issue_id in list(self.frames):
+                    if issue_id is not None and issue_id not in current:
+                        del self.frames[issue_id]
+
+
+class Timer:
+
+    __slots__ = ("due", "function", "tag", "interval", "cancelled")
+
+    def __init__(self, due, function, tag=None, interval=None):
+        self.due = due
+        self.function = function
+        self.tag = tag
+        self.interval = interval
+        self.cancelled = False
 
 
 class Timers:
@@ -168,88 +498,207 @@ class Timers:
     def __init__(self):
         """Timers definition.
 
-        self.timers = {
-            <datetime>: {
-                "function": <function>,
-                "tag": "some tag"
-            },
-            <datetime>: {
-                "function": <function>,
-                "tag": "some tag"
-            },
+        self.timers = [  # heap ordered by due time
+            (<monotonic due time>, <sequence>, <Timer>),
+        ]
+        self.tags = {
+            "some tag": {<Timer>, <Timer>},
         }
+
+        Due times come from time.monotonic, so wall clock adjustments do
+        not move them. Removed timers are only flagged and are dropped when
+        they reach the top of the heap. on_change, when set, is called
+        whenever a new timer is added so an event loop can wake up for it.
+        A profiler, when set, records how late each timer runs.
         """
-        self.timers = {}
+        self.timers = []
+        self.tags = {}
+        self.on_change = None
+        self.profiler = None
+        self._sequence = count()
+        self._lock = threading.RLock()
 
     def execute(self):
-        """Exceture any due task e remove it from the queue."""
-        for timer, task in list(self.timers.items()):
-            if datetime.now() >= timer:
-                self.timers.pop(timer)
-                task["function"]()
-
-    def add(self, due, function, tag=None):
-        """Add a new timed function to the queue."""
+        """Execute any due task and remove it from the queue."""
+        now = monotonic()
+        profiler = self.profiler
+        while True:
+            with self._lock:
+                if not self.timers or self.timers[0][0] > now:
+                    return
+                timer = heapq.heappop(self.timers)[2]
+                if timer.cancelled:
+                    continue
+                if timer.interval is None:
+                    self._untag(timer)
+            if profiler:
+                profiler.record("timer_lateness", (now - timer.due) * 1000)
+            timer.function()
+            with self._lock:
+                if timer.interval is not None and not timer.cancelled:
+                    # keep the original cadence but skip the ticks missed
+                    # while late, a late timer must not fire again at once
+                    timer.due += timer.interval
+                    if timer.due <= now:
+                        missed = (now - timer.due) // timer.interval + 1
+                        timer.due += missed * timer.interval
+                    self._push(timer)
+
+    def add(self, seconds, function, tag=None, repeat=False):
+        """Add a new timed function to the queue, due in seconds.
+
+        With repeat the function runs every seconds until removed.
+        """
         if not callable(function):
             raise Exception("timed function must be a callable")
-        self.timers[due] = {"function": function, "tag": tag}
+        if repeat and seconds <= 0:
+            raise Exception("repeating timers need a positive interval")
+        timer = Timer(monotonic() + seconds, function, tag,
+                      seconds if repeat else None)
+        with self._lock:
+            self._push(timer)
+            if tag is not None:
+                self.tags.setdefault(tag, set()).add(timer)
+        if self.on_change:
+            self.on_change()
+        return timer
 
     def remove_by_tag(self, tag):
         """Remove any timed function matching tag."""
-        for timer, task in list(self.timers.items()):
-            if task["tag"] == tag:
-                self.timers.pop(timer)
+        with self._lock:
+            for timer in self.tags.pop(tag, ()):
+                timer.cancelled = True
+
+    def time_until_next(self, default=None):
+        """Seconds until the next due task, or default if there is none."""
+        with self._lock:
+            while self.timers and self.timers[0][2].cancelled:
+                heapq.heappop(self.timers)
+            if not self.timers:
+                return default
+            return max(self.timers[0][0] - monotonic(), 0)
+
+    def _push(self, timer):
+        heapq.heappush(self.timers, (timer.due, next(self._sequence), timer))
+
+    def _untag(self, timer):
+        tagged = self.tags.get(timer.tag)
+        if tagged:
+            tagged.discard(timer)
+            if not tagged:
+                del self.tags[timer.tag]
 
 
 class Manager:
 
-    def __init__(self, config):
+    def __init__(self, config, api=None):
+        """Device state for one serial port.
+
+        Pass a long lived JiraAPI as api to share its HTTP session across
+        Manager instances instead of logging in again.
+        """
         self.config = config
-        self.serial = serial.Serial(config['serial_port'], 57600, timeout=1)
-        self.api = JiraAPI(config)
+        self.serial = serial.Serial(config['serial_port'], BAUD_RATE,
+                                    timeout=1)
+        self.compress_frames = config.get("compress_frames", True)
+        # only the framed handshake proves the firmware takes 'D' and 'C'
+        # frames, unframed they are sent when the config says so
+        self.delta_frames = config.get("delta_frames", False)
+        self.frames = self._plain_frame_link()
+        self._handshake = None
+        self.idle_after = config.get("idle_after")
+        self.idle_animation = config.get("idle_animation", IDLE_ANIMATION)
+        self.playback = None
+        self.api = api or JiraAPI(config)
         # self.serial = serial.Serial(config['serial_port'], 9600, timeout=1)
         self.issues = []
+        self._issue_index = {}
         self.display = Display(config, manager=self)
-        self.clock = 10  # Hz
+        self.selection_frames = SelectionFrames(compress=self.compress_frames)
+        self.outbox = Outbox(self.api,
+                             config.get("outbox_file", OUTBOX_FILE),
+                             on_flush=self.outbox_flushed,
+                             on_error=self.outbox_failed)
         self.timers = Timers()
+        profiling = config.get("profiling", {})
+        self.profiler = Profiler(
+            enabled=profiling.get("enabled", False),
+            stats_file=profiling.get("stats_file", PROFILING_FILE),
+            profile_slowest=profiling.get("profile_slowest", 0)
+        )
+        if self.profiler.enabled:
+            self.timers.profiler = self.profiler
+            self.timers.add(profiling.get("interval", 60), self.profiler.dump,
+                            "profiling", repeat=True)
         self.last_message = ("", datetime.now())
+        self._partial_line = b""
         self.waiting_ack = False
-        self._last_iteration = datetime.now()
+        self._display_lock = threading.Lock()
+        self._loop = None
+        self._executor = None
+        self._stopped = None
+        self._stopping = threading.Event()
+        self._timer_handle = None
 
     def start(self):
+        """Show the current screen, then my issues once Jira has them."""
+        self.timers.remove_by_tag("animation")
+        self.timers.remove_by_tag("start")
+        self.playback = None
         self.update_display()
-        self.refresh_issues()
+        self.run_blocking(self.fetch_issues, then=self.show_start,
+                          rollback=self.retry_start)
+
+    def retry_start(self, exc):
+        self.timers.add(START_RETRY_DELAY, self.start, "start")
+
+    def show_start(self, fetched):
+        self.show_issues(fetched)
         if self.issues:
             self.display.current_screen = "issue"
         else:
             self.display.current_screen = "issue_selection"
         self.update_display()
+        self.schedule_idle()
 
     def refresh_issues(self):
-        self.issues = self.api.get_my_issues(self.api.in_progress_status)
-        self.issues.extend(self.api.get_my_issues(self.api.todo_status))
-        if self.display.issue:
-            self.display.issue = next(
-                (i for i in self.issues if i.id == self.display.issue.id),
-                self.issues[0] if self.issues else None
-            )
+        self.show_issues(self.fetch_issues())
+
+    def fetch_issues(self):
+        """My issues by key and the one to show by default, from Jira.
+
+        May block, the rest of the device state is left to show_issues.
+        """
+        issues = self.api.my_issues_by_key()
+        in_progress = [i for i in issues
+                       if i.status_id == self.api.in_progress_status]
+        # the newest issue in progress, else the newest one
+        default = max(in_progress or issues, key=lambda issue: int(issue.id),
+                      default=None)
+        return issues, default
+
+    def show_issues(self, fetched):
+        self.issues, default = fetched
+        self._issue_index = {
+            issue.id: index for index, issue in enumerate(self.issues)
+        }
+        if self.display.issue and self.display.issue.id in self._issue_index:
+            self.display.issue = self.issues[
+                self._issue_index[self.display.issue.id]
+            ]
         else:
-            self.display.issue = self.issues[0] if self.issues else None
-        self.issues = sorted(self.issues, key=lambda x: x.key)
+            self.display.issue = default
+        self.selection_frames.prerender(self.issues)
 
-    def navigate_next_issue(self, issues):
+    def navigate_next_issue(self, step):
         self.timers.remove_by_tag("display_update")
         if self.display.current_screen == 'issue_selection':
-            if not self.display.issue_preview:
+            if not self.display.issue_preview or not self.issues:
                 return
-            current_issue = self.display.issue_preview
-            for index, issue in enumerate(issues):
-                if issue.id == current_issue.id:
-                    if index >= len(issues) - 1:
-                        next_issue = issues[0]
-                    else:
-                        next_issue = issues[(index + 1)]
-            self.display.issue_preview = next_issue
+            index = self._issue_index.get(self.display.issue_preview.id, -step)
+            self.display.issue_preview = self.issues[
+                (index + step) % len(self.issues)
+            ]
 
         else:
             self.display.current_screen = 'issue_selection'
@@ -258,12 +707,10 @@ class Manager:
         self.update_display()
 
     def left_button(self):
-        issues = self.issues[::-1]
-        self.navigate_next_issue(issues)
+        self.navigate_next_issue(-1)
 
     def right_button(self):
-        issues = self.issues[:]
-        self.navigate_next_issue(issues)
+        self.navigate_next_issue(1)
 
     def action_button(self):
         if self.display.current_screen == 'issue_selection':
@@ -277,11 +724,27 @@ class Manager:
                 self.update_display()
 
         elif self.display.current_screen == "issue":
-            self.refresh_issues()
+            # Show the outcome right away from local state. The changes go
+            # to the outbox and the screen is reconciled once Jira has them.
+            issue = self.display.issue
+            previous = self.display.status_override
+
+            def rollback(exc):
+                # the outbox never got the change, show the status as it was
+                self.display.status_override = previous
+                self.update_display_every(0.85)
+
             # Start a task
-            if self.display.issue.fields.status.id != self.api.in_progress_status:
-                self.api.start_issue(self.display.issue)
+            if self.display.status != self.api.in_progress_status:
+                info_log("Starting task {}".format(issue))
+                self.display.status_override = self.api.in_progress_status
                 self.display.start_time = datetime.now()
+                self.update_display_every(0.85)
+                # the outbox stops the other issues in progress when it
+                # sends this, nothing on the button path waits for Jira
+                self.run_blocking(self.outbox.start, issue,
+                                  rollback=rollback)
+                return
 
             # Stop a task
             else:
@@ -290,40 +753,136 @@ class Manager:
                     self.waiting_ack = False
                     self.display.blinking = False
                 else:
-                    self.api.change_status(self.display.issue, self.api.todo_status)
                     self.display.register_time()
+                    self.display.status_override = self.api.todo_status
                     self.timers.remove_by_tag("display_update")
-            self.refresh_issues()
+                    self.run_blocking(self.outbox.transition, issue,
+                                      self.api.todo_status, rollback=rollback)
             self.update_display_every(0.85)
 
+    def log_time(self, issue, seconds):
+        self.outbox.worklog(issue, seconds)
+        self.api.track_time(issue, seconds)
+
+    def outbox_flushed(self):
+        """Jira has every queued change, show its view of the issues.
+
+        Runs on the outbox thread, the loop fetches and shows the issues.
+        """
+        self.timers.add(0, partial(self.run_blocking, self.fetch_issues,
+                                   then=self.show_flushed))
+
+    def show_flushed(self, fetched):
+        self.show_issues(fetched)
+        self.display.status_override = None
+
+    def outbox_failed(self, entry, exc):
+        """Jira rejected a queued change, go back to what Jira says.
+
+        Runs on the outbox thread, the loop fetches and shows the issues.
+        """
+        if entry["type"] in ("start", "transition"):
+            self.api.expire_issues()
+            self.timers.add(0, partial(self.run_blocking, self.fetch_issues,
+                                       then=self.show_rejected))
+
+    def show_rejected(self, fetched):
+        self.display.status_override = None
+        self.show_issues(fetched)
+        self.update_display_every(0.85)
+
     def update_display_every(self, seconds):
-        next_job_time = datetime.now() + timedelta(seconds=seconds)
         self.timers.remove_by_tag("display_update")
-        self.timers.add(next_job_time,
-                        lambda: self.update_display_every(seconds),
-                        "display_update")
+        self.timers.add(seconds, self.update_display, "display_update",
+                        repeat=True)
         self.update_display()
 
+    def schedule_idle(self):
+        """Play the idle animation once nobody pushed a button for a while.
+
+        Set "idle_after" (seconds) in the config to turn it on, and
+        "idle_animation" to the GIF to play. Time tracking keeps the clock
+        on screen instead.
+        """
+        self.timers.remove_by_tag("idle")
+        if self.idle_after:
+            self.timers.add(self.idle_after, self.start_idle, "idle")
+
+    def start_idle(self):
+        if (self.display.issue
+                and self.display.status == self.api.in_progress_status):
+            self.schedule_idle()
+            return
+        self.timers.remove_by_tag("display_update")
+        self.playback = Playback(load_animation(self.idle_animation))
+        self.play_animation()
+
+    def play_animation(self):
+        if self.playback is None:
+            return
+        bitmap, delay = self.playback.next()
+        with self._display_lock, self.profiler.measure("serial_write"):
+            if not self._handshake:
+                self.frames.send_bitmap(bitmap)
+        self.timers.add(delay, self.play_animation, "animation")
+
+    def stop_idle(self):
+        self.timers.remove_by_tag("animation")
+        self.playback = None
+        if self.display.current_screen == "issue":
+            # start_idle stopped the issue screen ticks, a paused issue
+            # drops them again on this update
+            self.update_display_every(0.85)
+        else:
+            self.update_display()
+
     def update_display(self):
-        self.display.update()
-        if self.display._image:
-            self.serial.write(b'I')
-            image_bytes = bytearray()
-            bit_position = 0
-            binary = ''
-            for pixel in self.display._image.getdata():
-                bit_position += 1
-                binary += str(int(pixel > 0))
-                if bit_position == 8:
-                    self.serial.write(bytes([int(binary, 2)]))
-                    bit_position = 0
-                    binary = ''
+        if self.playback:
+            return  # the idle animation owns the screen
+        with self._display_lock, self.profiler.tick():
+            self.display.update()
+            if self.display.bitmap and not self._handshake:
+                with self.profiler.measure("serial_write"):
+                    self.frames.send_bitmap(self.display.bitmap,
+                                            self.display.frame)
 
     def read_serial(self):
-        message = self.serial.read_until().strip().decode()
+        # waiting up to the timeout for a message is not timed, reading it is
+        line = self.serial.read(1)
+        if line and line != b"\n":
+            with self.profiler.measure("read_serial"):
+                line += self.serial.read_until()
+        if not line.endswith(b"\n"):
+            # timed out in the middle of a message, finish it next time
+            self._partial_line += line
+            return
+        message = (self._partial_line + line).strip().decode()
+        self._partial_line = b""
+        with self.profiler.measure("handle_message"):
+            self.handle_message(message)
+
+    def handle_message(self, message):
         if message:
             print(message)
 
+        # frame acknowledgements are never noise
+        command, _, sequence = message.partition(" ")
+        if message == "end_image":
+            self.frames.ack()
+            return
+        elif command == "ack" and sequence.isdigit():
+            self.frames.ack(int(sequence))
+            return
+        elif command == "nak" and sequence.isdigit():
+            self.frames.nak(int(sequence))
+            return
+        elif message == "resync":
+            self.frames.resync()
+            self.update_display()
+            return
+        elif self.handshake_message(message):
+            return
+
         # filter message noises
         if self.last_message[0] == message:
             if (datetime.now() - self.last_message[1]).total_seconds() < 0.2:
@@ -331,6 +890,13 @@ class Manager:
                 return
         self.last_message = (message, datetime.now())
 
+        if message in ("prev", "next", "start"):
+            self.schedule_idle()
+            if self.playback:
+                # the push only wakes the device up
+                self.stop_idle()
+                return
+
         if message == "prev":
             self.left_button()
         elif message == "next":
@@ -340,24 +906,265 @@ class Manager:
             self.action_button()
 
         elif message == "reset":
+            self.negotiate_link()
+            self.api.expire_issues()
             self.start()
 
+    def run_blocking(self, function, *args, then=None, rollback=None):
+        """Call a function that may talk to Jira, then then(its result).
+
+        In asyncio mode it runs on the worker thread, one call at a time and
+        in order, so serial input and display ticks keep flowing meanwhile.
+        Only then runs back on the loop, the device state belongs to it.
+
+        A failure of function is logged and passed to rollback(exc), which
+        undoes what the screen already shows. It never stops the loop.
+        """
+        if not self._loop:
+            try:
+                result = function(*args)
+            except Exception as exc:
+                self._blocking_failed(rollback, exc)
+                return
+            if then:
+                then(result)
+            return
+        future = self._loop.run_in_executor(self._executor, function, *args)
+        future.add_done_callback(partial(self._blocking_done, then, rollback))
+
     def main_loop_iteration(self):
+        # block on serial input only until the next timer is due. pySerial
+        # reconfigures the port on every timeout change, so round it up to
+        # a few distinct values and only set it when it changes.
+        timeout = self.timers.time_until_next(default=1)
+        timeout = math.ceil(timeout / SERIAL_TIMEOUT_STEP) * SERIAL_TIMEOUT_STEP
+        if self.serial.timeout != timeout:
+            self.serial.timeout = timeout
         self.read_serial()
         self.timers.execute()
 
-    def exit(self):
-        info_log("Shutting down")
+    def reconnect(self, serial_port):
+        """Reopen the serial link only, keeping Jira and display state."""
+        try:
+            self.serial.close()
+        except serial.SerialException:
+            pass
+        self.config['serial_port'] = serial_port
+        self.serial = serial.Serial(serial_port, BAUD_RATE, timeout=1)
+        self._plain_link()
+        self._partial_line = b""
+
+    def negotiate_link(self):
+        """Switch to the framed protocol at the fastest baud rate that works.
+
+        Called when the device boots, it then listens at BAUD_RATE. It
+        answers the handshake with "baud <rate>" and switches to it, and a
+        ping at that rate must get a "pong". Otherwise both sides go back to
+        BAUD_RATE and ping once more. Older firmware ignores the handshake
+        and keeps getting unframed 'I' frames, plus 'D' and 'C' frames with
+        the delta_frames config set. No frames are sent meanwhile.
+
+        When a ping goes unanswered the device may still have taken it and
+        only its "pong" got lost, so it is told to leave the framed protocol
+        before the host falls back.
+        """
+        self._plain_link()
+        if not self.config.get("framed_protocol", True):
+            return
+        self._handshake = "baud"
+        self.serial.write(handshake(
+            self.config.get("max_baud_rate", BAUD_RATES[-1])))
+        self._restart_handshake_timer()
+
+    def handshake_message(self, message):
+        """Take the device's handshake answers, True if message was one."""
+        if self._handshake == "baud" and message.startswith("baud "):
+            with self._display_lock:
+                self.serial.flush()
+                self.serial.baudrate = int(message[len("baud "):])
+                self.serial.write(PING_COMMAND)
+            self._handshake = "ping"
+            self._restart_handshake_timer()
+        elif self._handshake in ("ping", "fallback") and message == "pong":
+            self.timers.remove_by_tag("handshake")
+            self._handshake = None
+            self.frames = FramedLink(self.serial, compress=self.compress_frames)
+            self.timers.add(self.frames.ack_timeout, self.frames.expire,
+                            "frame_link", repeat=True)
+            info_log("Framed protocol at {} baud".format(self.serial.baudrate))
+            self.update_display()
+        else:
+            return False
+        return True
+
+    def handshake_timeout(self):
+        if self._handshake == "ping":
+            # the device went back to BAUD_RATE by now, or is framed at the
+            # new rate if the pong got lost. Either way, try at BAUD_RATE.
+            self._reset_link()
+            self._handshake = "fallback"
+            with self._display_lock:
+                self.serial.write(PING_COMMAND)
+            self._restart_handshake_timer()
+            return
+        if self._handshake == "baud":
+            info_log("Device firmware has no framed protocol")
+        elif self._handshake == "fallback":
+            self._reset_link()
+        self._handshake = None
+        self.update_display()
+
+    def _reset_link(self):
+        """Get the device back to unframed frames at BAUD_RATE."""
+        with self._display_lock:
+            self.serial.write(UNFRAMED_COMMAND)
+            self.serial.flush()
+            self.serial.baudrate = BAUD_RATE
+
+    def _restart_handshake_timer(self):
+        self.timers.remove_by_tag("handshake")
+        self.timers.add(HANDSHAKE_TIMEOUT, self.handshake_timeout, "handshake")
+
+    def _plain_link(self):
+        """Unframed frames at BAUD_RATE, what the device starts with."""
+        self.timers.remove_by_tag("handshake")
+        self.timers.remove_by_tag("frame_link")
+        self._handshake = None
+        with self._display_lock:
+            if self.serial.baudrate != BAUD_RATE:
+                self.serial.baudrate = BAUD_RATE
+        self.frames = self._plain_frame_link()
+
+    def _plain_frame_link(self):
+        return FrameLink(self.serial, compress=self.compress_frames,
+                         deltas=self.delta_frames)
+
+    def close(self):
+        """Release the serial port and helper threads.
+
+        The time tracked so far is journaled in the outbox first, that is
+        local and does not wait for Jira.
+        """
+        atexit.unregister(self.exit)
         self.display.register_time()
+        self.outbox.close()
+        self.selection_frames.stop()
         self.serial.close()
 
+    def exit(self):
+        info_log("Shutting down")
+        self.close()
+
     def run(self):
         self.start()
+        atexit.unregister(self.exit)
         atexit.register(self.exit)
-        while True:
+        while not self._stopping.is_set():
             self.main_loop_iteration()
-            delay = (1 / self.clock) - (datetime.now() - self._last_iteration).total_seconds()
-            delay = delay if delay >= 0 else 1 / self.clock
-            sleep(delay)
 
+    def stop(self):
+        """Make run or run_async return, from any thread.
+
+        Join the thread running it before close, the loop may still be
+        reading the serial port until then.
+        """
+        self._stopping.set()
+        loop = self._loop
+        if loop:
+            try:
+                loop.call_soon_threadsafe(self._stop_loop)
+            except RuntimeError:
+                pass  # the loop already ended
+
+    def _stop_loop(self):
+        if self._stopped and not self._stopped.done():
+            self._stopped.set_result(None)
+
+    def run_async(self):
+        """Run on an asyncio event loop instead of the polling loop.
+
+        Serial input is read as soon as it arrives, timers are loop
+        callbacks and the Jira calls run in an executor, so button latency
+        and display ticks do not wait on each other. Needs a serial port
+        with a file descriptor (POSIX).
+        """
+        asyncio.run(self._run_async())
+
+    async def _run_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._stopped = self._loop.create_future()
+        if self._stopping.is_set():
+            self._stop_loop()
+        self.serial.timeout = 0
+        self.timers.on_change = lambda: self._loop.call_soon_threadsafe(
+            self._schedule_timers)
+        try:
+            self.start()
+            atexit.unregister(self.exit)
+            atexit.register(self.exit)
+            self._loop.add_reader(self.serial.fileno(), self._serial_readable)
+            self._schedule_timers()
+            await self._stopped
+        finally:
+            if self.serial.is_open:
+                self._loop.remove_reader(self.serial.fileno())
+            if self._timer_handle:
+                self._timer_handle.cancel()
+            self.timers.on_change = None
+            # let queued worklogs reach the outbox
+            self._executor.shutdown(wait=True)
+            self._loop = None
+
+    def _serial_readable(self):
+        try:
+            with self.profiler.measure("read_serial"):
+                data = self.serial.read(self.serial.in_waiting or 1)
+            lines = (self._partial_line + data).split(b"\n")
+            self._partial_line = lines.pop()
+            for line in lines:
+                with self.profiler.measure("handle_message"):
+                    self.handle_message(line.strip().decode())
+        except Exception as exc:
+            self._fail(exc)
+
+    def _schedule_timers(self):
+        if self._timer_handle:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+        delay = self.timers.time_until_next()
+        if delay is not None and self._loop:
+            self._timer_handle = self._loop.call_later(delay, self._run_timers)
+
+    def _run_timers(self):
+        self._timer_handle = None
+        try:
+            self.timers.execute()
+        except Exception as exc:
+            self._fail(exc)
+            return
+        self._schedule_timers()
+
+    def _blocking_done(self, then, rollback, future):
+        if future.cancelled():
+            return
+        if future.exception():
+            self._blocking_failed(rollback, future.exception())
+        elif then:
+            try:
+                then(future.result())
+            except Exception as exc:
+                self._fail(exc)
+
+    @staticmethod
+    def _blocking_failed(rollback, exc):
+        error_log("Jira call failed: {}".format(exc))
+        error_log("".join(traceback.format_exception(
+            type(exc), exc, exc.__traceback__)))
+        if rollback:
+            rollback(exc)
 
+    def _fail(self, exc):
+        """Stop the async loop, raising exc to the caller of run_async."""
+        if self._stopped and not self._stopped.done():
+            self._stopped.set_exception(exc)
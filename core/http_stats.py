@@ -0,0 +1,174 @@
+"""Cheap, switchable instrumentation of the HTTP calls made to Jira.
+
+Hooks into a requests Session as a response hook, so nothing runs at all
+while it is disabled. When enabled every response updates per endpoint
+counters and a latency histogram; a sample of the requests is also written
+as JSON lines by a background thread.
+"""
+
+import json
+import os
+import queue
+import re
+import sys
+import threading
+from bisect import bisect_left
+from datetime import datetime
+from random import random
+from urllib.parse import urlsplit
+
+# upper bounds in milliseconds, the last bucket takes anything slower
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# statuses the Jira client retries on its own, whether a retry follows
+# depends on the attempts it has left
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TRACE_QUEUE_SIZE = 1000
+
+# numeric ids and issue keys, "/10042" or "/PROJ-12", but not "/api/2"
+_ID_SEGMENT = re.compile(r"/(\d{3,}|[A-Za-z][A-Za-z0-9_]*-\d+)(?=/|$)")
+
+
+def endpoint(method, url):
+    """Request name with issue keys, ids and the like folded into {id}."""
+    return "{} {}".format(method, _ID_SEGMENT.sub("/{id}", urlsplit(url).path))
+
+
+class EndpointStats:
+
+    __slots__ = ("count", "errors", "retryable", "total_ms", "max_ms",
+                 "histogram", "statuses", "sent_bytes", "received_bytes")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retryable = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.statuses = {}
+        self.sent_bytes = 0
+        self.received_bytes = 0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retryable": self.retryable,
+            "mean_ms": self.total_ms / self.count if self.count else 0,
+            "max_ms": self.max_ms,
+            "histogram_ms": dict(zip(
+                [str(bound) for bound in LATENCY_BUCKETS] + ["inf"],
+                self.histogram
+            )),
+            "statuses": dict(self.statuses),
+            "sent_bytes": self.sent_bytes,
+            "received_bytes": self.received_bytes,
+        }
+
+
+class HttpStats:
+
+    def __init__(self, session, trace_file=None, sample_rate=0.01):
+        """Instrumentation for session, disabled until enable is called.
+
+        Args:
+            session: <requests.Session> to watch
+            trace_file (str): JSON lines file for sampled request traces
+            sample_rate (float): Share of the requests written to trace_file
+
+        """
+        self.session = session
+        self.trace_file = trace_file
+        self.sample_rate = sample_rate
+        self.endpoints = {}
+        self._lock = threading.Lock()
+        self._traces = None
+
+    @property
+    def enabled(self):
+        return self._record in self.session.hooks["response"]
+
+    def enable(self):
+        if self.enabled:
+            return
+        if self.trace_file and self._traces is None:
+            self._traces = queue.Queue(TRACE_QUEUE_SIZE)
+            threading.Thread(target=self._write_traces, daemon=True).start()
+        self.session.hooks["response"].append(self._record)
+
+    def disable(self):
+        if self.enabled:
+            self.session.hooks["response"].remove(self._record)
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+        return self.enabled
+
+    def snapshot(self):
+        """Stats so far, as {<endpoint>: {...}}."""
+        with self._lock:
+            return {name: stats.as_dict()
+                    for name, stats in self.endpoints.items()}
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+
+    def _record(self, response, *args, **kwargs):
+        request = response.request
+        name = endpoint(request.method, request.url)
+        elapsed_ms = response.elapsed.total_seconds() * 1000
+        sent = len(request.body or b"")
+        received = int(response.headers.get("Content-Length")
+                       or len(response.content or b""))
+        status = response.status_code
+
+        with self._lock:
+            stats = self.endpoints.get(name)
+            if stats is None:
+                stats = self.endpoints[name] = EndpointStats()
+            stats.count += 1
+            stats.errors += status >= 400
+            stats.retryable += status in RETRY_STATUSES
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.histogram[bisect_left(LATENCY_BUCKETS, elapsed_ms)] += 1
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            stats.sent_bytes += sent
+            stats.received_bytes += received
+
+        if self._traces is not None and random() < self.sample_rate:
+            try:
+                self._traces.put_nowait({
+                    "time": datetime.now().isoformat(),
+                    "endpoint": name,
+                    "url": request.url,
+                    "status": status,
+                    "elapsed_ms": elapsed_ms,
+                    "sent_bytes": sent,
+                    "received_bytes": received,
+                })
+            except queue.Full:
+                pass  # never hold up a request for a trace
+
+    def _write_traces(self):
+        while True:
+            traces = [self._traces.get()]
+            while not self._traces.empty():
+                traces.append(self._traces.get_nowait())
+            try:
+                self._write_batch(traces)
+            except OSError as exc:
+                print("Could not write HTTP traces: {}".format(exc),
+                      file=sys.stderr)
+
+    def _write_batch(self, traces):
+        directory = os.path.dirname(self.trace_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.trace_file, "a") as sink:
+            for trace in traces:
+                sink.write(json.dumps(trace) + "\n")
@@ -0,0 +1,80 @@
+"""Compact local copies of the Jira issues the device shows."""
+
+from bisect import bisect_left, insort
+
+
+class IssueSummary:
+    """The few fields of a Jira issue the device uses."""
+
+    __slots__ = ("id", "key", "summary", "status_id", "timespent",
+                 "project_id", "issuetype_id")
+
+    def __init__(self, id, key, summary="", status_id=None, timespent=None,
+                 project_id=None, issuetype_id=None):
+        self.id = id
+        self.key = key
+        self.summary = summary
+        self.status_id = status_id
+        self.timespent = timespent
+        self.project_id = project_id
+        self.issuetype_id = issuetype_id
+
+    @classmethod
+    def from_issue(cls, issue):
+        """Build from a <JIRA Issue>, dropping everything else it holds."""
+        fields = issue.fields
+        project = getattr(fields, "project", None)
+        issue_type = getattr(fields, "issuetype", None)
+        return cls(
+            issue.id,
+            issue.key,
+            getattr(fields, "summary", ""),
+            fields.status.id,
+            getattr(fields, "timespent", None),
+            project and project.id,
+            issue_type and issue_type.id,
+        )
+
+    def __str__(self):
+        return self.key
+
+    def __repr__(self):
+        return "<IssueSummary {}>".format(self.key)
+
+
+class IssueStore:
+    """Issues indexed by id and by key, with the keys kept sorted."""
+
+    def __init__(self, issues=()):
+        self.by_id = {}
+        self.by_key = {}
+        self._keys = []
+        for issue in issues:
+            self.put(issue)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def get(self, issue_id):
+        return self.by_id.get(issue_id)
+
+    def put(self, issue):
+        """Add or replace an issue."""
+        self.remove(issue.id)
+        self.by_id[issue.id] = issue
+        self.by_key[issue.key] = issue
+        insort(self._keys, issue.key)
+
+    def remove(self, issue_id):
+        issue = self.by_id.pop(issue_id, None)
+        if issue:
+            del self.by_key[issue.key]
+            del self._keys[bisect_left(self._keys, issue.key)]
+        return issue
+
+    def sorted(self):
+        """Issues ordered by key."""
+        return [self.by_key[key] for key in self._keys]
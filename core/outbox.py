@@ -0,0 +1,238 @@
+"""Durable queue of the Jira changes the device makes.
+
+Worklogs and transitions are appended to a local journal before anything is
+sent to Jira, so slow or unreachable Jira never blocks the device and never
+loses tracked time. A background thread replays the journal in order.
+"""
+
+import json
+import os
+import threading
+import traceback
+from datetime import datetime
+
+from jira import JIRAError
+
+from core import BASE_DIR, error_log, info_log
+
+OUTBOX_FILE = os.path.join(BASE_DIR, "../logs/outbox.jsonl")
+FSYNC_INTERVAL = 1  # seconds
+RETRY_MIN_DELAY = 1  # seconds
+RETRY_MAX_DELAY = 5 * 60  # seconds
+
+
+class Outbox:
+
+    def __init__(self, api, filename, on_flush=None, on_error=None):
+        """Journal definition, one JSON object per line.
+
+        {"id": 1, "type": "worklog", "issue": "PROJ-1", "seconds": 120}
+        {"id": 2, "type": "transition", "issue": "PROJ-1", "status": "3"}
+        {"id": 3, "type": "start", "issue": "PROJ-2"}
+        {"done": [1, 2]}
+
+        Entries without a matching "done" line are pending and are replayed
+        on start. Writes reach the OS right away and are fsynced in batches
+        every FSYNC_INTERVAL, and on close.
+
+        on_flush() is called after pending entries were sent. on_error(entry,
+        exc) is called when Jira rejects an entry for good. Such entries are
+        parked with their error in the failed file next to the journal, one
+        JSON object per line, to be fixed up and logged by hand. Both
+        callbacks run on the outbox thread.
+        """
+        self.api = api
+        self.filename = filename
+        self.failed_filename = os.path.splitext(filename)[0] + ".failed.jsonl"
+        self.on_flush = on_flush
+        self.on_error = on_error
+        self.pending = []
+        self._next_id = 1
+        self._lock = threading.Condition()
+        self._closed = False
+        self._stop = threading.Event()  # cuts a retry delay short
+        self._dirty = False
+        self._fsync_timer = None
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        self._load()
+        self._file = open(filename, "a")
+        self._worker = threading.Thread(target=self._work, daemon=True)
+        self._worker.start()
+
+    def worklog(self, issue, seconds):
+        self._append({"type": "worklog", "issue": issue.key,
+                      "seconds": int(seconds)})
+
+    def transition(self, issue, status_id):
+        self._append({"type": "transition", "issue": issue.key,
+                      "status": status_id})
+
+    def start(self, issue):
+        """Put issue in progress and any other issue in progress back to do."""
+        self._append({"type": "start", "issue": issue.key})
+
+    def close(self):
+        """Fsync the journal and stop, leaving unsent entries for next start.
+
+        Does not wait for Jira: a change still being sent stays pending and
+        is sent again on the next start.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._fsync()
+            self._file.close()
+            self._lock.notify()
+        self._stop.set()
+
+    def _load(self):
+        entries = {}
+        if os.path.exists(self.filename):
+            with open(self.filename) as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn write at a crash
+                    if "done" in record:
+                        for entry_id in record["done"]:
+                            entries.pop(entry_id, None)
+                    else:
+                        entries[record["id"]] = record
+                        self._next_id = max(self._next_id, record["id"] + 1)
+        self.pending = list(entries.values())
+        if self.pending:
+            info_log("Replaying {} Jira changes".format(len(self.pending)))
+        # compact: only the pending entries survive a restart
+        compacted = self.filename + ".tmp"
+        with open(compacted, "w") as journal:
+            for entry in self.pending:
+                journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(compacted, self.filename)
+
+    def _append(self, entry):
+        with self._lock:
+            entry["id"] = self._next_id
+            self._next_id += 1
+            self._write(entry)
+            self.pending.append(entry)
+            self._lock.notify()
+
+    def _write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._dirty = True
+        # on a timer of its own, the worker may be stuck on a slow Jira
+        if self._fsync_timer is None:
+            self._fsync_timer = threading.Timer(FSYNC_INTERVAL,
+                                                self._fsync_due)
+            self._fsync_timer.daemon = True
+            self._fsync_timer.start()
+
+    def _fsync(self):
+        if self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _fsync_due(self):
+        with self._lock:
+            self._fsync_timer = None
+            if not self._closed:
+                self._fsync()
+
+    def _park(self, batch, exc):
+        """Keep entries Jira rejected for good out of the journal."""
+        with open(self.failed_filename, "a") as failed:
+            for entry in batch:
+                failed.write(json.dumps(dict(
+                    entry, error=str(exc), failed_at=datetime.now().isoformat()
+                )) + "\n")
+            failed.flush()
+            os.fsync(failed.fileno())
+        error_log("Parked {} rejected Jira changes in {}".format(
+            len(batch), self.failed_filename))
+
+    def _next_batch(self):
+        """Oldest pending entry merged with adjacent worklogs of its issue."""
+        first = self.pending[0]
+        batch = [first]
+        if first["type"] == "worklog":
+            for entry in self.pending[1:]:
+                if entry["type"] != "worklog" or entry["issue"] != first["issue"]:
+                    break
+                batch.append(entry)
+        return batch
+
+    def _send(self, batch):
+        issue = self.api.find_issue(batch[0]["issue"])
+        if batch[0]["type"] == "worklog":
+            self.api.add_time(issue, sum(entry["seconds"] for entry in batch))
+        elif batch[0]["type"] == "start":
+            # what is in progress when it is sent, a retry stops the rest
+            for in_progress in self.api.my_issues(self.api.in_progress_status):
+                if in_progress.id != issue.id:
+                    self.api.change_status(in_progress, self.api.todo_status)
+            self.api.change_status(issue, self.api.in_progress_status)
+        else:
+            self.api.change_status(issue, batch[0]["status"])
+
+    def _work(self):
+        delay = RETRY_MIN_DELAY
+        while True:
+            with self._lock:
+                while not self._closed and not self.pending:
+                    self._lock.wait()
+                if self._closed:
+                    return
+                batch = self._next_batch()
+
+            try:
+                self._send(batch)
+            except Exception as exc:
+                error_log("Jira change failed: {}".format(exc))
+                error_log(traceback.format_exc())
+                if not self._permanent(exc):
+                    # new entries queue behind this one, only close wakes it
+                    self._stop.wait(delay)
+                    delay = min(delay * 2, RETRY_MAX_DELAY)
+                    continue
+                self._park(batch, exc)
+                if self.on_error:
+                    self._callback(self.on_error, batch[0], exc)
+            delay = RETRY_MIN_DELAY
+
+            with self._lock:
+                if self._closed:
+                    return  # the journal is closed, the batch stays pending
+                for entry in batch:
+                    self.pending.remove(entry)
+                self._write({"done": [entry["id"] for entry in batch]})
+                if not self.pending:
+                    # nothing left to replay, start a fresh journal
+                    self._file.truncate(0)
+                    self._fsync()
+                idle = not self.pending
+            if idle and self.on_flush:
+                self._callback(self.on_flush)
+
+    @staticmethod
+    def _callback(function, *args):
+        """Call on_flush or on_error, their failures never stop the worker."""
+        try:
+            function(*args)
+        except Exception as exc:
+            error_log("Outbox callback failed: {}".format(exc))
+            error_log(traceback.format_exc())
+
+    @staticmethod
+    def _permanent(exc):
+        """Errors retrying will not fix, like a missing issue or transition."""
+        if isinstance(exc, KeyError):
+            return True
+        if isinstance(exc, JIRAError):
+            return exc.status_code in (400, 403, 404)
+        return False
@@ -0,0 +1,127 @@
+"""Timing of the display hot path: render, encode, serial and loop jitter.
+
+Each measured section keeps a rolling window of its latest durations, and
+the percentiles are dumped as JSON to a stats file. Optionally every display
+tick also runs under cProfile and the profiles of the slowest ones are kept.
+"""
+
+import cProfile
+import heapq
+import io
+import json
+import pstats
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from time import perf_counter
+
+WINDOW_SIZE = 1000
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(ordered, percent):
+    if not ordered:
+        return 0
+    index = min(int(len(ordered) * percent / 100), len(ordered) - 1)
+    return ordered[index]
+
+
+class Profiler:
+
+    def __init__(self, enabled=False, stats_file=None, profile_slowest=0):
+        """Rolling timings definition.
+
+        self.samples = {
+            "render": deque([<milliseconds>, ...], maxlen=WINDOW_SIZE),
+        }
+        self.slowest = [(<milliseconds>, <sequence>, <cProfile text>), ...]
+
+        Args:
+            enabled (bool): Measure anything at all
+            stats_file (str): Where dump writes the stats as JSON
+            profile_slowest (int): Keep cProfile output of the N slowest ticks
+
+        """
+        self.enabled = enabled
+        self.stats_file = stats_file
+        self.profile_slowest = profile_slowest
+        self.samples = {}
+        self.slowest = []
+        self._sequence = count()
+
+    def record(self, name, milliseconds):
+        if not self.enabled:
+            return
+        window = self.samples.get(name)
+        if window is None:
+            window = self.samples[name] = deque(maxlen=WINDOW_SIZE)
+        window.append(milliseconds)
+
+    @contextmanager
+    def measure(self, name):
+        """Time the body of a with block under name."""
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (perf_counter() - start) * 1000)
+
+    @contextmanager
+    def tick(self, name="tick"):
+        """Like measure, also profiling the block when profile_slowest is set."""
+        if not self.enabled or not self.profile_slowest:
+            with self.measure(name):
+                yield
+            return
+        profile = cProfile.Profile()
+        start = perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            milliseconds = (perf_counter() - start) * 1000
+            self.record(name, milliseconds)
+            self._keep_if_slow(milliseconds, profile)
+
+    def _keep_if_slow(self, milliseconds, profile):
+        if (len(self.slowest) >= self.profile_slowest
+                and milliseconds <= self.slowest[0][0]):
+            return
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats(
+            "cumulative").print_stats(20)
+        entry = (milliseconds, next(self._sequence), output.getvalue())
+        if len(self.slowest) < self.profile_slowest:
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heapreplace(self.slowest, entry)
+
+    def stats(self):
+        """Percentiles of every measured section, in milliseconds."""
+        stats = {}
+        for name, window in list(self.samples.items()):
+            ordered = sorted(window)
+            stats[name] = {"count": len(ordered),
+                           "max": ordered[-1] if ordered else 0}
+            for percent in PERCENTILES:
+                stats[name]["p{}".format(percent)] = percentile(ordered,
+                                                                percent)
+        return stats
+
+    def dump(self):
+        """Write stats and the slowest tick profiles to stats_file."""
+        if not self.enabled or not self.stats_file:
+            return
+        with open(self.stats_file, "w") as stats_file:
+            json.dump({
+                "sections": self.stats(),
+                "slowest_ticks": [
+                    {"milliseconds": milliseconds, "profile": profile}
+                    for milliseconds, _, profile in sorted(self.slowest,
+                                                           reverse=True)
+                ],
+            }, stats_file, indent=4)
@@ -0,0 +1,164 @@
+"""Animations packed once into frame files and played from memory maps.
+
+A GIF is converted to mode '1', packed the way the firmware wants it and
+written with its frame durations to a frame file in ANIMATION_CACHE_DIR,
+named after the GIF's absolute path and modification time. The file is
+rebuilt when the GIF's modification time or size changes.
+Playing maps the file and hands out memoryview slices of it, so no frame is
+decoded, packed or copied again.
+
+Frame file layout, little endian:
+
+    b"JDA1" <source mtime ns: int64> <source size: uint32> <frames: uint32>
+    <duration ms: uint16> * frames
+    <packed bitmap: FRAME_SIZE bytes> * frames
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from functools import lru_cache
+from os import path
+from time import monotonic
+
+from PIL import Image, ImageSequence
+
+from display.base import BaseDisplay
+from display.encoder import pack_image
+
+BASE_DIR = path.dirname(path.abspath(__file__))
+ANIMATION_CACHE_DIR = path.join(BASE_DIR, "../cache/animations")
+MAGIC = b"JDA1"
+HEADER = struct.Struct("<4sqII")
+FRAME_SIZE = BaseDisplay.size[0] * BaseDisplay.size[1] // 8
+# what browsers do with GIFs asking for 0 or 10 ms
+DEFAULT_FRAME_DURATION = 100  # ms
+MIN_FRAME_DURATION = 20  # ms
+
+
+def frames_path(gif_path, mtime_ns):
+    """Frame file of gif_path, GIFs of the same name do not share one."""
+    gif_path = path.abspath(gif_path)
+    key = hashlib.sha1("{}:{}".format(gif_path, mtime_ns).encode())
+    return path.join(ANIMATION_CACHE_DIR, "{}-{}.frames".format(
+        path.basename(gif_path), key.hexdigest()[:16]))
+
+
+def build_frames(gif_path, target):
+    """Pack every frame of gif_path into the frame file target."""
+    source = os.stat(gif_path)
+    durations = []
+    bitmaps = []
+    with Image.open(gif_path) as gif:
+        for frame in ImageSequence.Iterator(gif):
+            duration = frame.info.get("duration") or DEFAULT_FRAME_DURATION
+            if duration <= 10:
+                duration = DEFAULT_FRAME_DURATION
+            durations.append(max(duration, MIN_FRAME_DURATION))
+            image = frame.copy()
+            if image.size != BaseDisplay.size:
+                image = image.resize(BaseDisplay.size)
+            bitmaps.append(pack_image(image.convert(mode="1")))
+
+    os.makedirs(path.dirname(target), exist_ok=True)
+    # a temporary file of its own, devices on other threads may be building
+    # the same target
+    descriptor, temporary = tempfile.mkstemp(dir=path.dirname(target),
+                                             suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as frames_file:
+            frames_file.write(HEADER.pack(MAGIC, source.st_mtime_ns,
+                                          source.st_size, len(bitmaps)))
+            frames_file.write(struct.pack("<{}H".format(len(durations)),
+                                          *durations))
+            frames_file.writelines(bitmaps)
+        os.replace(temporary, target)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def is_fresh(gif_path, target):
+    """Whether target holds the frames of gif_path as it is now."""
+    try:
+        with open(target, "rb") as frames_file:
+            magic, mtime_ns, size, _ = HEADER.unpack(
+                frames_file.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    source = os.stat(gif_path)
+    return (magic == MAGIC and mtime_ns == source.st_mtime_ns
+            and size == source.st_size)
+
+
+class Animation:
+    """Packed frames of a frame file, read through a memory map."""
+
+    def __init__(self, filename):
+        with open(filename, "rb") as frames_file:
+            # the map stays valid once the file is closed or replaced
+            self._map = mmap.mmap(frames_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        _, _, _, count = HEADER.unpack_from(self._map)
+        self.durations = [
+            milliseconds / 1000 for milliseconds in
+            struct.unpack_from("<{}H".format(count), self._map, HEADER.size)
+        ]
+        self._offset = HEADER.size + 2 * count
+
+    def __len__(self):
+        return len(self.durations)
+
+    def frame(self, index):
+        """Packed bitmap of frame index, a memoryview into the file."""
+        start = self._offset + index * FRAME_SIZE
+        return self._view[start:start + FRAME_SIZE]
+
+
+@lru_cache(maxsize=None)
+def _load(gif_path, mtime_ns, size):
+    target = frames_path(gif_path, mtime_ns)
+    if not is_fresh(gif_path, target):
+        build_frames(gif_path, target)
+    return Animation(target)
+
+
+def load_animation(gif_path):
+    """Animation of gif_path, packing its frames first if they are stale.
+
+    Mapped animations are kept for the life of the process, as the link
+    may still hold frames of one after it stopped playing.
+    """
+    source = os.stat(gif_path)
+    return _load(path.abspath(gif_path), source.st_mtime_ns, source.st_size)
+
+
+class Playback:
+    """Frame by frame walk through an animation against deadlines.
+
+    Every frame is due when the ones before it have had their durations,
+    counted from the start, so the time spent sending frames does not add
+    up. Frames whose time already passed are skipped to catch up.
+    """
+
+    def __init__(self, animation, now=None):
+        self.animation = animation
+        self.index = 0
+        self.due = monotonic() if now is None else now
+
+    def next(self, now=None):
+        """Return (frame to show now, seconds until the next one is due)."""
+        now = monotonic() if now is None else now
+        durations = self.animation.durations
+        if now - self.due > sum(durations):
+            self.due = now  # way behind, after a pause for example
+        while now >= self.due + durations[self.index]:
+            self.due += durations[self.index]
+            self.index = (self.index + 1) % len(durations)
+        bitmap = self.animation.frame(self.index)
+        self.due += durations[self.index]
+        self.index = (self.index + 1) % len(durations)
+        return bitmap, max(self.due - now, 0)
@@ -1,7 +1,10 @@
 from datetime import timedelta
+from functools import lru_cache
 from os import path
 from PIL import Image, ImageDraw, ImageFont
 
+from display.encoder import pack_image
+
 BASE_DIR = path.dirname(path.abspath(__file__))
 
 DEFAULT_FONT = ImageFont.truetype(path.join(BASE_DIR, "default.ttf"), 16)
@@ -10,18 +13,7 @@ SMALL_DEFAULT_FONT = ImageFont.truetype(path.join(BASE_DIR, "digital.ttf"), 13)
 MEDIUM_DEFAULT_FONT = ImageFont.truetype(path.join(BASE_DIR, "digital.ttf"), 23)
 
 def image_to_hex(image):
-    data = image.getdata()
-    output = []
-    bit_position = 0
-    binary = ''
-    for pixel in data:
-        bit_position += 1
-        binary += str(int(pixel > 0))
-        if bit_position == 8:
-            output.append(hex(int(binary, 2)))
-            bit_position = 0
-            binary = ''
-    return output
+    return [hex(byte) for byte in pack_image(image)]
 
 def image_to_bin(image):
     data = image.getdata()
@@ -60,6 +52,149 @@ def image_to_bin(image):
             binary = ''
 
 
+class Glyph:
+    """A rasterized glyph and the metrics needed to place it like the font.
+
+    x and y are where the ink lands when the char alone is drawn at (0, 0),
+    top is the top of its outline box. The box fields are font.getsize's
+    view, which measures with other hinting than the mono rendering.
+    """
+
+    __slots__ = ("mask", "x", "y", "top", "shift", "advance",
+                 "box_left", "box_right", "box_bottom", "box_advance")
+
+    def __init__(self, font, char):
+        # keep the bearing: ink may start left of the pen or above it
+        left, top, right, bottom = font.getbbox(char, "1")
+        image = Image.new('1', (right - left, bottom - top), 0)
+        ImageDraw.Draw(image).text((-left, -top), char, fill=1, font=font)
+        ink = image.getbbox() or (0, 0, 1, 1)
+        self.mask = image.crop(ink)
+        self.x = left + ink[0]
+        self.y = top + ink[1]
+        self.top = top
+        self.shift = 0
+        self.advance = round(font.getlength(char, "1") * 64)
+        self.box_left, _, self.box_right, self.box_bottom = font.getbbox(
+            char, "L")
+        self.box_advance = round(font.getlength(char, "L") * 64)
+
+
+class GlyphAtlas:
+    """Pre-rasterized glyphs of a small fixed alphabet.
+
+    Text made only of these characters is drawn by pasting bitmaps where
+    the font renderer would put them, so no font work happens per frame.
+    Anything outside the alphabet falls back to rendering with the font
+    itself. Glyphs are rasterized on first use.
+
+    The renderer lines a string up by the outline boxes of its glyphs but
+    places each glyph by its bitmap, which may round a pixel apart. How far
+    is measured once per glyph, next to a reference glyph, as its shift.
+    """
+
+    def __init__(self, font, alphabet):
+        self.font = font
+        self.alphabet = alphabet
+        self._glyphs = None
+        self._kerning = None
+
+    @property
+    def glyphs(self):
+        if self._glyphs is None:
+            self._rasterize()
+        return self._glyphs
+
+    def _rasterize(self):
+        font = self.font
+        glyphs = {char: Glyph(font, char) for char in self.alphabet}
+
+        first = self.alphabet[0]
+        reference = glyphs[first]
+        for char in self.alphabet[1:]:
+            glyph = glyphs[char]
+            pair = Image.new('1', font.getbbox(first + char, "1")[2:], 0)
+            ImageDraw.Draw(pair).text((0, 0), first + char, fill=1, font=font)
+            x = (reference.advance + 32) >> 6
+            glyph.shift = (_ink_top(pair, reference, 0) - reference.y
+                           - _ink_top(pair, glyph, x) + glyph.y)
+
+        # (mono, getsize) spacing of the pairs the font kerns
+        kerning = {}
+        for first in self.alphabet:
+            for second in self.alphabet:
+                spacing = (
+                    round(font.getlength(first + second, "1") * 64)
+                    - glyphs[first].advance - glyphs[second].advance,
+                    round(font.getlength(first + second, "L") * 64)
+                    - glyphs[first].box_advance - glyphs[second].box_advance,
+                )
+                if any(spacing):
+                    kerning[first + second] = spacing
+        self._kerning = kerning
+        self._glyphs = glyphs
+
+    def covers(self, text):
+        return all(char in self.glyphs for char in text)
+
+    def _layout(self, text, mode=0):
+        """Yield (glyph, pen x) of every char, in pixels.
+
+        The pen moves in 1/64 pixels like in the font renderer, by the mono
+        advances (mode 0) or by the ones getsize measures with (mode 1).
+        """
+        glyphs = self.glyphs
+        kerning = self._kerning
+        pen = 0
+        previous = None
+        for char in text:
+            glyph = glyphs[char]
+            if previous is not None and previous + char in kerning:
+                pen += kerning[previous + char][mode]
+            yield glyph, (pen + 32) >> 6
+            pen += glyph.box_advance if mode else glyph.advance
+            previous = char
+
+    def getsize(self, text):
+        """Same as font.getsize(text)."""
+        if not text or not self.covers(text):
+            left, _, right, bottom = self.font.getbbox(text, "L")
+            return (right - left, bottom)
+        left = right = bottom = 0
+        for glyph, x in self._layout(text, mode=1):
+            left = min(left, x + glyph.box_left)
+            right = max(right, x + glyph.box_right)
+            bottom = max(bottom, glyph.box_bottom)
+        return (right - left, bottom)
+
+    def text(self, image, xy, text, fill):
+        """Draw text on image the way ImageDraw.text would."""
+        if not text or not self.covers(text):
+            ImageDraw.Draw(image).text(xy, text, fill=fill, font=self.font)
+            return
+        placed = list(self._layout(text))
+        # the line is placed by outline boxes, glyphs by their bitmaps
+        line = (max(glyph.shift - glyph.top for glyph, _ in placed)
+                + min(glyph.top for glyph, _ in placed))
+        x, y = xy
+        for glyph, pen in placed:
+            image.paste(fill, (x + pen + glyph.x,
+                               y + line - glyph.shift + glyph.y), glyph.mask)
+
+
+def _ink_top(image, glyph, x):
+    """Top row of the ink in the columns glyph covers when drawn at x."""
+    columns = image.crop((x + glyph.x, 0, x + glyph.x + glyph.mask.size[0],
+                          image.size[1]))
+    return (columns.getbbox() or (0, 0))[1]
+
+
+# built lazily, importing this module does no font work
+CLOCK_ATLAS = GlyphAtlas(CLOCK_FONT, "0123456789:;")
+SMALL_ATLAS = GlyphAtlas(SMALL_DEFAULT_FONT,
+                         "abcdefghijklmnopqrstuvwxyz0123456789")
+MEDIUM_ATLAS = GlyphAtlas(MEDIUM_DEFAULT_FONT, "0123456789")
+
 
 class BaseDisplay:
 
@@ -73,97 +208,127 @@ class BaseDisplay:
         self.image.save(filename)
 
 
+# shared by every device the host drives
+TEXT_LAYOUT_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=None)
+def advance_width(char, font=DEFAULT_FONT):
+    return font.getlength(char, "L")
+
+
+@lru_cache(maxsize=TEXT_LAYOUT_CACHE_SIZE)
+def text_layout(text, width=BaseDisplay.size[0], height=BaseDisplay.size[1]):
+    """Wrap text in the two lines of DisplayText.
+
+    Measures the text incrementally from per character advance widths and
+    stops as soon as it no longer fits, so long summaries cost linear time.
+    Returns ((line, y), (line, y)).
+    """
+    lines = ["", ""]
+    x = 0
+    for char in text:
+        if x > 2 * width:
+            break
+        elif x < width - 10:
+            lines[0] += char
+        elif x < 2 * width:
+            lines[1] += char
+        x += advance_width(char)
+
+    return (
+        (lines[0], 0),
+        (lines[1], height - DEFAULT_FONT.getbbox(lines[1], "L")[3] - 1)
+    )
+
+
 class DisplayText(BaseDisplay):
 
     def __init__(self, text, inversed_colors=False):
         super().__init__(inversed_colors)
-        lines = ["", ""]
-        for i in range(len(text)):
-            x, y = DEFAULT_FONT.getsize(text[:i])
-            if x > 2 * self.size[0]:
-                break
-            elif x < self.size[0] - 10:
-                lines[0] += text[i]
-            elif x < 2 * self.size[0]:
-                lines[1] += text[i]
-
-        # Line 1
-        self.d.text(
-            (
-                0,  # X start position
-                0  # Y start position
-            ),
-            lines[0],  # Text
-            fill=(int(not inversed_colors),),  # color
-            font=DEFAULT_FONT
-        )
-        # Line 2
-        self.d.text(
-            (
-                0,  # X start position
-                self.size[1] - DEFAULT_FONT.getsize(lines[1])[1] - 1
-            ),
-            lines[1],
-            fill=(int(not inversed_colors),),  # color
-            font=DEFAULT_FONT
-        )
+        for line, y in text_layout(text, *self.size):
+            self.d.text(
+                (
+                    0,  # X start position
+                    y  # Y start position
+                ),
+                line,  # Text
+                fill=(int(not inversed_colors),),  # color
+                font=DEFAULT_FONT
+            )
+
+
+ISSUE_LAYER_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=ISSUE_LAYER_CACHE_SIZE)
+def issue_layer(issue_key, status, inversed_colors=False):
+    """Render the parts of the issue screen that do not change every tick.
+
+    Cached, so a running issue only pays for its clock on each update.
+    Callers must copy the returned image before drawing on it.
+    """
+    layer = BaseDisplay(inversed_colors)
+    project_key, issue_code = issue_key.lower().split("-")
+
+    project_key_size = SMALL_ATLAS.getsize(project_key)
+    issue_code_size = MEDIUM_ATLAS.getsize(issue_code)
+
+    # status
+    SMALL_ATLAS.text(
+        layer.image,
+        (
+            5,  # X start position
+            1  # Y start position
+        ),
+        status,  # Text
+        fill=(int(not inversed_colors),)  # color
+    )
+    # project key
+    SMALL_ATLAS.text(
+        layer.image,
+        (
+            5,  # X start position
+            layer.size[1] - project_key_size[1] - 1  # Y start position
+        ),
+        project_key,  # Text
+        fill=(int(not inversed_colors),)  # color
+    )
+    # issue code
+    MEDIUM_ATLAS.text(
+        layer.image,
+        (
+            5 + project_key_size[0],
+            layer.size[1] - issue_code_size[1] - 1
+        ),
+        issue_code,
+        fill=(int(not inversed_colors),)
+    )
+    return layer.image
 
 
 class DisplayIssue(BaseDisplay):
 
     def __init__(self, issue, status, clock=None, inversed_colors=False):
-        super().__init__(inversed_colors)
+        self.image = issue_layer(issue.key, status, inversed_colors).copy()
 
-        project_key, issue_code = issue.key.lower().split("-")
         if not clock:
-            spent = issue.fields.timespent or 0
+            spent = issue.timespent or 0
             if spent >= 60 * 60:  # one hour
                 spent = int(spent / 60)  # this variable become minutes
             clock = "{:02d}:{:02d}".format(int(spent / 60), int(spent % 60))
 
-        status_size = SMALL_DEFAULT_FONT.getsize(status)
-        project_key_size = SMALL_DEFAULT_FONT.getsize(project_key)
-        issue_code_size = MEDIUM_DEFAULT_FONT.getsize(issue_code)
-        clock_size = CLOCK_FONT.getsize(clock)
+        clock_size = CLOCK_ATLAS.getsize(clock)
 
-        # status
-        self.d.text(
-            (
-                5,  # X start position
-                1  # Y start position
-            ),
-            status,  # Text
-            fill=(int(not inversed_colors),),  # color
-            font=SMALL_DEFAULT_FONT
-        )
-        # project key
-        self.d.text(
-            (
-                5,  # X start position
-                self.size[1] - project_key_size[1] - 1  # Y start position
-            ),
-            project_key,  # Text
-            fill=(int(not inversed_colors),),  # color
-            font=SMALL_DEFAULT_FONT
-        )
-        # issue code
-        self.d.text(
-            (
-                5 + project_key_size[0],
-                self.size[1] - issue_code_size[1] - 1
-            ),
-            issue_code, fill=(int(not inversed_colors),),
-            font=MEDIUM_DEFAULT_FONT
-        )
         # clock
-        self.d.text(
+        CLOCK_ATLAS.text(
+            self.image,
             (
                 self.size[0] - clock_size[0] - 1,
                 -2
             ),
             clock,
-            fill=(int(not inversed_colors),),
-            font=CLOCK_FONT
+            fill=(int(not inversed_colors),)
         )
 
 
@@ -0,0 +1,392 @@
+"""Pack display images into the byte layout expected by the Arduino firmware.
+
+The firmware hands the received buffer straight to the SSD1306
+``drawBitmap``, which reads rows top to bottom, 8 pixels per byte with the
+most significant bit on the left and 1 meaning a lit pixel. That is exactly
+how PIL stores a mode '1' image, so packing is a single ``tobytes`` call.
+
+Wire budget at 57600 baud (8N1, 10 bits per byte on the wire):
+
+    57600 / 10 = 5760 bytes per second
+    'I' + 512 bytes = 513 bytes per frame -> ~89 ms -> ~11.2 frames per second
+"""
+
+import binascii
+import threading
+from time import monotonic
+
+BAUD_RATE = 57600
+BITS_PER_BYTE = 10  # start bit + 8 data bits + stop bit
+BYTES_PER_SECOND = BAUD_RATE // BITS_PER_BYTE
+IMAGE_COMMAND = b'I'
+
+
+def pack_image(image):
+    """Return the image as packed ``drawBitmap`` bytes."""
+    if image.mode != '1':
+        image = image.convert(mode='1')
+    return image.tobytes()
+
+
+def frame_bytes(image):
+    """Return the full raw frame: image command followed by the bitmap."""
+    return IMAGE_COMMAND + pack_image(image)
+
+
+def send_image(serial, image):
+    """Write a whole frame to the serial port with a single write."""
+    frame = frame_bytes(image)
+    serial.write(frame)
+    return len(frame)
+
+
+def wire_time(byte_count, baud_rate=BAUD_RATE):
+    """Seconds it takes to push byte_count bytes through the serial link."""
+    return byte_count * BITS_PER_BYTE / baud_rate
+
+
+DELTA_COMMAND = b'D'
+RANGE_HEADER_SIZE = 3  # 2 bytes offset + 1 byte length
+MAX_RANGE_LENGTH = 255
+MAX_RANGES = 255
+
+
+def diff_ranges(previous, current):
+    """Return (offset, data) chunks where current differs from previous.
+
+    Chunks closer than a range header are merged, since resending a few
+    unchanged bytes is cheaper than opening a new range.
+    """
+    ranges = []
+    start = end = None
+    for index, (old, new) in enumerate(zip(previous, current)):
+        if old == new:
+            continue
+        if start is not None and index - end <= RANGE_HEADER_SIZE:
+            end = index + 1
+            continue
+        if start is not None:
+            ranges.append((start, end))
+        start, end = index, index + 1
+    if start is not None:
+        ranges.append((start, end))
+
+    chunks = []
+    for start, end in ranges:
+        for offset in range(start, end, MAX_RANGE_LENGTH):
+            chunks.append(
+                (offset, current[offset:min(end, offset + MAX_RANGE_LENGTH)])
+            )
+    return chunks
+
+
+def delta_frame(previous, current):
+    """Return a delta frame patching previous into current.
+
+    Returns None when a delta can not express the change or would not be
+    smaller than a full frame.
+    """
+    if previous is None or len(previous) != len(current):
+        return None
+    chunks = diff_ranges(previous, current)
+    if len(chunks) > MAX_RANGES:
+        return None
+    frame = bytearray(DELTA_COMMAND)
+    frame.append(len(chunks))
+    for offset, data in chunks:
+        frame += offset.to_bytes(2, "big")
+        frame.append(len(data))
+        frame += data
+    if len(frame) >= len(current) + len(IMAGE_COMMAND):
+        return None
+    return bytes(frame)
+
+
+COMPRESSED_COMMAND = b'C'
+MAX_RUN = 128
+
+
+def packbits(data):
+    """Compress data with PackBits.
+
+    Each chunk starts with a header byte n: 0..127 is followed by n + 1
+    literal bytes, 129..255 (-127..-1 signed) is followed by one byte that is
+    repeated 257 - n times. The firmware decodes straight into its image
+    buffer, so no extra RAM is needed on the Nano.
+    """
+    output = bytearray()
+    literal_start = index = 0
+    size = len(data)
+    while index < size:
+        run_end = index + 1
+        while (run_end < size and run_end - index < MAX_RUN
+               and data[run_end] == data[index]):
+            run_end += 1
+        run_length = run_end - index
+        # runs of 2 only pay off when they do not split a literal chunk
+        if run_length >= 3 or (run_length == 2 and literal_start == index):
+            _flush_literals(output, data, literal_start, index)
+            output.append(257 - run_length)
+            output.append(data[index])
+            index = literal_start = run_end
+        else:
+            index = run_end
+    _flush_literals(output, data, literal_start, size)
+    return bytes(output)
+
+
+def _flush_literals(output, data, start, end):
+    for offset in range(start, end, MAX_RUN):
+        chunk = data[offset:min(end, offset + MAX_RUN)]
+        output.append(len(chunk) - 1)
+        output += chunk
+
+
+def unpackbits(data):
+    """Decode PackBits data, mirroring the firmware decoder."""
+    output = bytearray()
+    index = 0
+    while index < len(data):
+        header = data[index]
+        index += 1
+        if header < 128:
+            output += data[index:index + header + 1]
+            index += header + 1
+        elif header > 128:
+            output += bytes([data[index]]) * (257 - header)
+            index += 1
+    return bytes(output)
+
+
+def full_frame(bitmap, compress=True):
+    """Return the smallest full frame for bitmap, raw or compressed."""
+    raw = IMAGE_COMMAND + bitmap
+    if not compress:
+        return raw
+    compressed = COMPRESSED_COMMAND + packbits(bitmap)
+    return compressed if len(compressed) < len(raw) else raw
+
+
+class EncodedFrame:
+    """A packed bitmap with the frames that show it, encoded ahead of time.
+
+    full is its smallest full frame. deltas maps bitmaps that are likely on
+    screen before it to the delta frames patching them into it, or None
+    where a delta does not pay off.
+    """
+
+    __slots__ = ("bitmap", "full", "deltas")
+
+    def __init__(self, bitmap, compress=True):
+        self.bitmap = bitmap
+        self.full = full_frame(bitmap, compress)
+        self.deltas = {}
+
+    def encode_deltas(self, previous_bitmaps):
+        """Encode the deltas from previous_bitmaps, dropping any others."""
+        deltas = {}
+        for previous in previous_bitmaps:
+            if previous in self.deltas:
+                deltas[previous] = self.deltas[previous]
+            else:
+                deltas[previous] = delta_frame(previous, self.bitmap)
+        self.deltas = deltas  # swapped whole, readers may hold the old one
+
+    def frame_from(self, previous):
+        """Smallest frame turning previous, a bitmap or None, into this."""
+        deltas = self.deltas
+        if previous in deltas:
+            delta = deltas[previous]
+        else:
+            delta = delta_frame(previous, self.bitmap)
+        if delta is not None and len(delta) < len(self.full):
+            return delta
+        return self.full
+
+
+class FrameLink:
+    """Send frames as deltas against the last frame the device acknowledged.
+
+    The firmware answers every frame with ``end_image``. A delta is only
+    valid against a bitmap the device is known to hold, so while a frame is
+    still unacknowledged, or after the device asks for a ``resync``, the
+    next frame goes out in full. Full frames are PackBits compressed when
+    compress is set and that makes them smaller.
+
+    Firmware older than the 'D' and 'C' frames reads them as garbage, so
+    with deltas unset every frame goes out as a raw 'I' frame.
+    """
+
+    def __init__(self, serial, compress=True, deltas=True):
+        self.serial = serial
+        self.compress = compress
+        self.deltas = deltas
+        self.acked = None
+        self.pending = None
+
+    def send(self, image):
+        """Send image using the smallest frame the device can apply."""
+        return self.send_bitmap(pack_image(image))
+
+    def send_bitmap(self, bitmap, encoded=None):
+        """Send an already packed bitmap, see send.
+
+        Pass its <EncodedFrame> as encoded when it was encoded ahead of time.
+        """
+        if self.pending is None and bitmap == self.acked:
+            return 0
+        if not self.deltas:
+            frame = IMAGE_COMMAND + bitmap
+        else:
+            encoded = encoded or EncodedFrame(bitmap, self.compress)
+            if self.pending is None:
+                frame = encoded.frame_from(self.acked)
+            else:
+                frame = encoded.full
+        self.serial.write(frame)
+        self.pending = bitmap
+        return len(frame)
+
+    def ack(self, sequence=None):
+        """The device confirmed it is showing the last frame sent."""
+        if self.pending is not None:
+            self.acked = self.pending
+            self.pending = None
+
+    def resync(self):
+        """Forget device state so the next frame is sent in full."""
+        self.acked = None
+        self.pending = None
+
+
+FRAME_START = 0xA5
+FRAME_HEADER_SIZE = 5  # start, sequence, command, 2 bytes payload length
+HANDSHAKE_COMMAND = b'H'
+PING_COMMAND = b'P'
+# back to unframed frames at BAUD_RATE, two bytes so that noise between
+# packets does not drop the device out of the framed protocol
+UNFRAMED_COMMAND = b'U\xaa'
+# the baud rate code sent with the handshake indexes this table, all of
+# them are exact or close to it with the Nano's 16 MHz clock
+BAUD_RATES = (57600, 115200, 250000, 500000)
+RX_BUFFER_SIZE = 64  # serial receive buffer of the Nano
+FRAME_WINDOW = 4
+ACK_TIMEOUT = 0.5  # seconds
+
+
+def crc16(data):
+    """CRC-16/CCITT-FALSE, what the firmware gets from _crc_xmodem_update."""
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def frame_packet(sequence, frame):
+    """Wrap a frame, command byte and payload, into a checked packet.
+
+    <0xA5> <sequence> <command> <length high> <length low> <payload>
+    <CRC high> <CRC low>, the CRC covering everything after the start byte.
+    """
+    body = (bytes((sequence, frame[0]))
+            + (len(frame) - 1).to_bytes(2, "big") + frame[1:])
+    return bytes((FRAME_START,)) + body + crc16(body).to_bytes(2, "big")
+
+
+def handshake(baud_rate):
+    """Handshake asking for the fastest supported rate up to baud_rate."""
+    code = max(index for index, rate in enumerate(BAUD_RATES)
+               if rate <= baud_rate or index == 0)
+    return HANDSHAKE_COMMAND + bytes((code,))
+
+
+class FramedLink(FrameLink):
+    """Send frames as checked packets the device acknowledges one by one.
+
+    The device answers ``ack <sequence>`` once a packet is on screen and
+    ``nak <sequence>`` when its CRC or contents are wrong. After a NAK it
+    refuses deltas until the next full frame, so deltas can be made against
+    the last frame sent rather than the last one acknowledged, and several
+    packets can be in flight.
+
+    The Nano parses one packet at a time and buffers only RX_BUFFER_SIZE
+    bytes meanwhile, while it refreshes the display for example. A packet
+    is only sent while others are in flight when it fits in that buffer
+    with the ones queued ahead of it; otherwise the newest bitmap waits
+    for the next acknowledgement. On a NAK or a missing acknowledgement
+    the newest bitmap is sent again as a full frame.
+
+    Firmware that completes the framed handshake takes 'D' and 'C' frames,
+    so the link always uses them.
+    """
+
+    def __init__(self, serial, compress=True, window=FRAME_WINDOW,
+                 ack_timeout=ACK_TIMEOUT):
+        super().__init__(serial, compress)
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.in_flight = []  # [(sequence, bitmap, packet size, sent at)]
+        self.sent = None
+        self.latest = None  # <EncodedFrame> the host wants on screen
+        self.queued = None  # <EncodedFrame> waiting for room to be sent
+        self.retransmits = 0
+        self._sequence = 0
+        self._lock = threading.RLock()
+
+    def send_bitmap(self, bitmap, encoded=None):
+        with self._lock:
+            encoded = encoded or EncodedFrame(bitmap, self.compress)
+            self.latest = encoded
+            if bitmap == self.sent:
+                self.queued = None
+                return 0
+            packet = frame_packet(self._sequence,
+                                  encoded.frame_from(self.sent))
+            if self.in_flight and (
+                    len(self.in_flight) >= self.window
+                    or sum(size for _, _, size, _ in self.in_flight[1:])
+                    + len(packet) > RX_BUFFER_SIZE):
+                self.queued = encoded
+                return 0
+            self.queued = None
+            self.serial.write(packet)
+            self.in_flight.append(
+                (self._sequence, bitmap, len(packet), monotonic()))
+            self._sequence = (self._sequence + 1) % 256
+            self.sent = bitmap
+            return len(packet)
+
+    def ack(self, sequence=None):
+        with self._lock:
+            if not any(flight[0] == sequence for flight in self.in_flight):
+                return
+            while self.in_flight:
+                flight_sequence, self.acked = self.in_flight.pop(0)[:2]
+                if flight_sequence == sequence:
+                    break
+            if self.queued is not None:
+                self.send_bitmap(self.queued.bitmap, self.queued)
+
+    def nak(self, sequence):
+        with self._lock:
+            # later packets in flight get a NAK too, recover only once
+            if any(flight[0] == sequence for flight in self.in_flight):
+                self._retransmit()
+
+    def expire(self):
+        """Send again when the oldest packet was not acknowledged in time."""
+        with self._lock:
+            if (self.in_flight and monotonic() - self.in_flight[0][3]
+                    > self.ack_timeout):
+                self._retransmit()
+
+    def resync(self):
+        with self._lock:
+            super().resync()
+            self.in_flight = []
+            self.sent = None
+            self.queued = None
+
+    def _retransmit(self):
+        self.retransmits += 1
+        latest = self.latest
+        self.resync()
+        if latest is not None:
+            self.send_bitmap(latest.bitmap, latest)
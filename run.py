@@ -3,47 +3,72 @@
 """Every time you don't DOC your code god kills a kitten."""
 
 from time import sleep
-from core.request_debugger import requests
 from serial import SerialException
 import json
 from os import path
+import queue
+import signal
+import threading
 import traceback
-from core import error_log
-from core.base import Manager
+from core import error_log, info_log
+from core.base import JIRA_POOL_SIZE, PROFILING_FILE, JiraClients, Manager
+from core.outbox import OUTBOX_FILE
+from display.animation import Playback, load_animation
+from display.encoder import IMAGE_COMMAND
 
 BASE_DIR = path.dirname(path.abspath(__file__))
+SERIAL_RETRY_DELAY = 0.2  # seconds
 
 
 def screen_saver(config):
     """Because why not? Let's call it 'Benchmark'."""
     import serial
-    from PIL import Image
-    from PIL import GifImagePlugin
-    image = Image.open(path.join(BASE_DIR, "images/si.gif"))
-    gif = []
-    for frame in range(image.n_frames):
-        image.seek(frame)
-        f = image.copy()
-        gif.append(f.convert(mode="1"))
-
+    animation = load_animation(path.join(BASE_DIR, "images/si.gif"))
     ser = serial.Serial(config['serial_port'], 57600, timeout=1)
-    f = True
+    playback = Playback(animation)
     while True:
-        for _image in gif:
-            # f = not f
-            # if f:
-            #     continue
-            ser.write(b'I')
-            bit_position = 0
-            binary = ''
-            for pixel in _image.getdata():
-                bit_position += 1
-                binary += str(int(pixel > 0))
-                if bit_position == 8:
-                    ser.write(bytes([int(binary, 2)]))
-                    bit_position = 0
-                    binary = ''
-            sleep(0.08)
+        bitmap, delay = playback.next()
+        ser.write(IMAGE_COMMAND + bitmap)
+        sleep(delay)
+
+
+def toggle_http_stats(api):
+    """Switch Jira HTTP stats on or off, logging them when switched off."""
+    if not api.http_stats.toggle():
+        info_log("HTTP stats: {}".format(json.dumps(api.http_stats.snapshot())))
+        api.http_stats.reset()
+
+
+def device_configs(config):
+    """One config per device, each "devices" profile over the base config.
+
+    Without "devices" the base config is the only device. A profile that
+    names its own serial_port only fails over within its own serial_ports,
+    and every device gets its own outbox journal and profiling stats.
+    """
+    profiles = config.get("devices")
+    if not profiles:
+        return [config]
+    configs = []
+    for index, profile in enumerate(profiles):
+        device = {key: value for key, value in config.items()
+                  if key != "devices"}
+        device.update(profile)
+        name = device.setdefault("name", "device{}".format(index))
+        if "serial_ports" not in profile:
+            device["serial_ports"] = [device["serial_port"]]
+        if "outbox_file" not in profile:
+            device["outbox_file"] = path.join(
+                path.dirname(OUTBOX_FILE), "outbox-{}.jsonl".format(name))
+        if "profiling" in device and "stats_file" not in device["profiling"]:
+            device["profiling"] = dict(
+                device["profiling"],
+                stats_file=path.join(path.dirname(PROFILING_FILE),
+                                     "profiling-{}.json".format(name))
+            )
+        configs.append(device)
+    return configs
+
 
 def main():
     config = {}
@@ -52,6 +77,46 @@ def main():
 
     # screen_saver(config)
 
+    configs = device_configs(config)
+    clients = JiraClients(pool_size=JIRA_POOL_SIZE * len(configs))
+
+    # The handler only queues the request: it interrupts whatever the main
+    # thread holds, the stats lock included, so the toggling and logging
+    # happen on a thread of their own.
+    toggles = queue.SimpleQueue()
+
+    def toggle_all_http_stats():
+        while True:
+            toggles.get()
+            for api in clients.all():
+                toggle_http_stats(api)
+
+    threading.Thread(target=toggle_all_http_stats, daemon=True).start()
+    signal.signal(signal.SIGUSR1, lambda *args: toggles.put(None))
+    if len(configs) == 1:
+        serve(configs[0], clients)
+        return
+
+    # every device on its own thread, so a slow device or a slow Jira user
+    # only holds up itself
+    threads = [
+        threading.Thread(target=serve, args=(device, clients),
+                         name=device["name"], daemon=True)
+        for device in configs
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def serve(config, clients):
+    """Run one device for good, reopening its serial port when it fails."""
+    name = config.get("name")
+
+    def log(msg):
+        error_log("{}: {}".format(name, msg) if name else msg)
+
     def rotate_serial_port(config):
         current_index = config["serial_ports"].index(config["serial_port"])
         try:
@@ -61,20 +126,37 @@ def main():
         config["serial_port"] = next_port
         return config
 
+    # The Jira client outlives serial failures: a USB glitch only reopens
+    # the port, keeping the login, connection pool and issue cache.
+    api = None
+    manager = None
     while True:
         try:
-            manager = Manager(config)
-            manager.start()
-            manager.run()
+            if api is None:
+                api = clients.get(config)
+            if manager is None:
+                manager = Manager(config, api=api)
+            elif not manager.serial.is_open:
+                manager.reconnect(config["serial_port"])
+            if config.get("asyncio"):
+                manager.run_async()
+            else:
+                manager.start()
+                manager.run()
         except SerialException as exc:
-            error_log(exc)
-            error_log(traceback.format_exc())
+            log(exc)
+            log(traceback.format_exc())
+            if manager:
+                manager.serial.close()
             config = rotate_serial_port(config)
-            error_log("Rotating to port {}".format(config["serial_port"]))
-            sleep(1)
+            log("Rotating to port {}".format(config["serial_port"]))
+            sleep(SERIAL_RETRY_DELAY)
         except Exception as exc:
-            error_log(exc)
-            error_log(traceback.format_exc())
+            log(exc)
+            log(traceback.format_exc())
+            if manager:
+                manager.close()
+                manager = None
             sleep(1)
 
 
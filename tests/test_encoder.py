@@ -0,0 +1,322 @@
+"""Frames must reach the device as exactly what the host encoded."""
+
+import random
+
+import pytest
+
+from display import encoder
+from display.encoder import (
+    COMPRESSED_COMMAND, DELTA_COMMAND, FRAME_HEADER_SIZE, FRAME_START,
+    IMAGE_COMMAND, MAX_RUN, RX_BUFFER_SIZE, FrameLink, FramedLink, crc16,
+    delta_frame, diff_ranges, frame_packet, packbits, unpackbits
+)
+
+BITMAP_SIZE = 512
+
+
+def crc_xmodem_update(crc, byte):
+    """avr-libc's _crc_xmodem_update, what the firmware checks packets with."""
+    crc ^= byte << 8
+    for _ in range(8):
+        crc = (crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1
+    return crc & 0xFFFF
+
+
+def firmware_crc(data):
+    crc = 0xFFFF  # readFrame starts from it
+    for byte in data:
+        crc = crc_xmodem_update(crc, byte)
+    return crc
+
+
+def bitmaps():
+    """Frames like the screens send: blank, text-like, noisy and striped."""
+    randomized = random.Random(0)
+    text = bytearray(BITMAP_SIZE)
+    for index in randomized.sample(range(BITMAP_SIZE), 60):
+        text[index] = randomized.randrange(256)
+    return [
+        bytes(BITMAP_SIZE),
+        bytes((0xFF,)) * BITMAP_SIZE,
+        bytes(text),
+        randomized.randbytes(BITMAP_SIZE),
+        bytes((0x00, 0x00, 0xFF)) * 170 + bytes((0x0F, 0xF0)),
+        bytes(range(256)) * 2,
+    ]
+
+
+def read_packbits(data):
+    """Image buffer as readPackBits fills it, None where it gives up."""
+    image = bytearray()
+    index = 0
+    while len(image) < BITMAP_SIZE:
+        if index >= len(data):
+            return None
+        header = data[index]
+        index += 1
+        if header < 128:
+            length = header + 1
+            chunk = data[index:index + length]
+            index += length
+        elif header > 128:
+            length = 257 - header
+            chunk = data[index:index + 1] * length
+            index += 1
+        else:
+            continue
+        if len(chunk) != length or len(image) + length > BITMAP_SIZE:
+            return None
+        image += chunk
+    return bytes(image), index
+
+
+def read_delta(previous, frame):
+    """previous patched with a delta frame as readDelta does, None if bad."""
+    image = bytearray(previous)
+    assert frame[:1] == DELTA_COMMAND
+    index = 2
+    for _ in range(frame[1]):
+        offset = int.from_bytes(frame[index:index + 2], "big")
+        length = frame[index + 2]
+        index += 3
+        if offset + length > BITMAP_SIZE:
+            return None
+        image[offset:offset + length] = frame[index:index + length]
+        index += length
+    return bytes(image) if index == len(frame) else None
+
+
+def read_packet(packet):
+    """(sequence, frame) of a packet as readFrame takes it, None if damaged."""
+    if packet[0] != FRAME_START or len(packet) < FRAME_HEADER_SIZE + 2:
+        return None
+    length = int.from_bytes(packet[3:FRAME_HEADER_SIZE], "big")
+    if len(packet) != FRAME_HEADER_SIZE + length + 2:
+        return None
+    crc = int.from_bytes(packet[-2:], "big")
+    if firmware_crc(packet[1:-2]) != crc:
+        return None
+    return packet[1], packet[2:3] + packet[FRAME_HEADER_SIZE:-2]
+
+
+def test_crc16_check_value():
+    assert crc16(b"123456789") == 0x29B1  # CRC-16/CCITT-FALSE
+
+
+@pytest.mark.parametrize("size", [0, 1, 4, 63, 64, 513, 1000])
+def test_crc16_matches_firmware(size):
+    data = random.Random(size).randbytes(size)
+    assert crc16(data) == firmware_crc(data)
+
+
+@pytest.mark.parametrize("sequence", [0, 1, 127, 255])
+@pytest.mark.parametrize("frame", [
+    IMAGE_COMMAND + bytes(BITMAP_SIZE),
+    IMAGE_COMMAND + random.Random(1).randbytes(BITMAP_SIZE),
+    COMPRESSED_COMMAND + bytes((129, 0)) * 4,
+    DELTA_COMMAND + bytes((1, 0x01, 0xFF, 2, 0xA5, 0x5A)),
+    DELTA_COMMAND + bytes((0,)),
+])
+def test_frame_packet_round_trip(sequence, frame):
+    assert read_packet(frame_packet(sequence, frame)) == (sequence, frame)
+
+
+def test_frame_packet_flipped_bits_are_caught():
+    packet = frame_packet(7, DELTA_COMMAND + bytes((1, 0, 10, 3, 1, 2, 3)))
+    for index in range(1, len(packet)):
+        for bit in range(8):
+            damaged = bytearray(packet)
+            damaged[index] ^= 1 << bit
+            assert read_packet(bytes(damaged)) is None
+
+
+@pytest.mark.parametrize("bitmap", bitmaps())
+def test_packbits_round_trip(bitmap):
+    packed = packbits(bitmap)
+    assert unpackbits(packed) == bitmap
+    # the firmware stops at 512 bytes, nothing may be left over
+    assert read_packbits(packed) == (bitmap, len(packed))
+    chunks = -(-len(bitmap) // MAX_RUN)
+    assert len(packed) <= len(bitmap) + chunks
+
+
+@pytest.mark.parametrize("data", [
+    b"", b"a", b"aa", b"ab", b"aab", b"abb", b"aaab",
+    b"a" * (MAX_RUN + 1), b"ab" * MAX_RUN, b"abc" + b"d" * 300 + b"ef",
+])
+def test_packbits_round_trip_edges(data):
+    assert unpackbits(packbits(data)) == data
+
+
+@pytest.mark.parametrize("previous", bitmaps())
+@pytest.mark.parametrize("current", bitmaps())
+def test_delta_frame_round_trip(previous, current):
+    frame = delta_frame(previous, current)
+    if frame is None:
+        return  # a full frame is no larger, that is sent instead
+    assert len(frame) < len(IMAGE_COMMAND) + len(current)
+    assert read_delta(previous, frame) == current
+
+
+def test_delta_frame_sparse_changes():
+    randomized = random.Random(2)
+    previous = randomized.randbytes(BITMAP_SIZE)
+    for changes in (1, 2, 5, 20, 50):
+        current = bytearray(previous)
+        for index in randomized.sample(range(BITMAP_SIZE), changes):
+            current[index] ^= 0xFF
+        current = bytes(current)
+        frame = delta_frame(previous, current)
+        assert frame is not None
+        assert read_delta(previous, frame) == current
+
+
+def test_diff_ranges_cover_every_change():
+    previous = bytes(BITMAP_SIZE)
+    current = bytearray(previous)
+    current[3] = current[5] = current[450] = 1
+    current[100:400] = b"\x02" * 300  # longer than one range can be
+    current = bytes(current)
+    patched = bytearray(previous)
+    for offset, data in diff_ranges(previous, current):
+        assert 0 < len(data) <= 255
+        patched[offset:offset + len(data)] = data
+    assert bytes(patched) == current
+
+
+def test_delta_frame_without_previous():
+    assert delta_frame(None, bytes(BITMAP_SIZE)) is None
+    assert delta_frame(bytes(10), bytes(BITMAP_SIZE)) is None
+
+
+class RecordingSerial:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+
+def test_frame_link_without_deltas_sends_raw_frames():
+    serial = RecordingSerial()
+    link = FrameLink(serial, deltas=False)
+    blank = bytes(BITMAP_SIZE)
+    dot = b"\x01" + blank[1:]
+    for bitmap in (blank, dot, dot, blank):
+        link.send_bitmap(bitmap)
+        link.ack()
+    assert serial.written == [IMAGE_COMMAND + bitmap
+                              for bitmap in (blank, dot, blank)]
+
+
+def test_frame_link_deltas_against_the_acked_frame():
+    serial = RecordingSerial()
+    link = FrameLink(serial)
+    blank = bytes(BITMAP_SIZE)
+    dot = b"\x01" + blank[1:]
+    link.send_bitmap(blank)
+    link.send_bitmap(dot)  # the blank frame is not acknowledged yet
+    link.ack()
+    link.send_bitmap(blank)
+    assert [frame[:1] for frame in serial.written] == [
+        COMPRESSED_COMMAND, COMPRESSED_COMMAND, DELTA_COMMAND]
+    assert read_delta(dot, serial.written[-1]) == blank
+
+
+def dotted(*indexes):
+    bitmap = bytearray(BITMAP_SIZE)
+    for index in indexes:
+        bitmap[index] = 0xFF
+    return bytes(bitmap)
+
+
+def shown(serial):
+    """(sequences, bitmap) the device shows after the packets written."""
+    sequences, image = [], None
+    for packet in serial.written:
+        sequence, frame = read_packet(packet)
+        sequences.append(sequence)
+        if frame[:1] == COMPRESSED_COMMAND:
+            image = read_packbits(frame[1:])[0]
+        elif frame[:1] == IMAGE_COMMAND:
+            image = frame[1:]
+        else:
+            image = read_delta(image, frame)
+    return sequences, image
+
+
+def test_framed_link_window_limits_packets_in_flight():
+    serial = RecordingSerial()
+    link = FramedLink(serial, window=4)
+    for index in range(7):
+        link.send_bitmap(dotted(index))
+    assert len(serial.written) == 4
+    assert link.queued.bitmap == dotted(6)  # only the newest waits
+    link.ack(1)
+    assert [flight[0] for flight in link.in_flight] == [2, 3, 4]
+    assert shown(serial) == ([0, 1, 2, 3, 4], dotted(6))
+    link.ack(4)
+    assert link.in_flight == [] and link.queued is None
+    assert link.acked == dotted(6)
+
+
+def test_framed_link_keeps_packets_in_flight_within_the_rx_buffer():
+    serial = RecordingSerial()
+    link = FramedLink(serial, window=10)
+    # ~40 byte delta packets, the first packet is parsed, not buffered
+    stripes = [random.Random(3).randbytes(BITMAP_SIZE)]
+    for start in (100, 200):
+        previous = stripes[-1]
+        stripes.append(previous[:start] + bytes(30) + previous[start + 30:])
+    for bitmap in stripes:
+        link.send_bitmap(bitmap)
+    assert len(serial.written) == 2
+    assert len(serial.written[1]) <= RX_BUFFER_SIZE
+    assert len(serial.written[1]) * 2 > RX_BUFFER_SIZE
+    assert link.queued.bitmap == stripes[2]
+    link.ack(0)
+    assert shown(serial) == ([0, 1, 2], stripes[2])
+
+
+def test_framed_link_ignores_unknown_acks():
+    serial = RecordingSerial()
+    link = FramedLink(serial)
+    link.send_bitmap(dotted(1))
+    link.ack(5)
+    assert len(link.in_flight) == 1 and link.acked is None
+
+
+def test_framed_link_nak_resends_the_newest_frame_in_full():
+    serial = RecordingSerial()
+    link = FramedLink(serial)
+    for index in range(3):
+        link.send_bitmap(dotted(index))
+    link.nak(1)
+    link.nak(2)  # the device naks what follows a bad packet too
+    assert link.retransmits == 1
+    sequence, frame = read_packet(serial.written[-1])
+    assert sequence == 3
+    assert frame[:1] in (COMPRESSED_COMMAND, IMAGE_COMMAND)
+    assert [flight[0] for flight in link.in_flight] == [3]
+    serial.written[1:3] = []  # what the device threw away
+    assert shown(serial)[1] == dotted(2)
+
+
+def test_framed_link_resends_when_an_ack_is_missing(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(encoder, "monotonic", lambda: now[0])
+    serial = RecordingSerial()
+    link = FramedLink(serial, ack_timeout=0.5)
+    link.send_bitmap(dotted(1))
+    now[0] += 0.4
+    link.expire()
+    assert len(serial.written) == 1
+    now[0] += 0.2
+    link.expire()
+    assert link.retransmits == 1
+    assert [read_packet(packet)[0] for packet in serial.written] == [0, 1]
+    assert read_packet(serial.written[1])[1] == read_packet(serial.written[0])[1]
+    link.ack(1)
+    now[0] += 1
+    link.expire()
+    assert link.retransmits == 1
@@ -0,0 +1,55 @@
+"""The glyph atlases must draw exactly what the fonts draw."""
+
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from display.base import CLOCK_ATLAS, MEDIUM_ATLAS, SMALL_ATLAS
+
+ATLASES = {"clock": CLOCK_ATLAS, "small": SMALL_ATLAS, "medium": MEDIUM_ATLAS}
+SAMPLES = {
+    "clock": ["00:00", "12:34", "59;59", "99:11", "1", ":"],
+    "small": ["run", "paused", "running", "proj", "f", "xk", "abc123"],
+    "medium": ["0", "1", "2048", "1111", "907"],
+}
+
+
+def font_size(font, text):
+    """What font.getsize returns, also on Pillow versions without it."""
+    if hasattr(font, "getsize"):
+        return font.getsize(text)
+    left, _, right, bottom = font.getbbox(text, "L")
+    return (right - left, bottom)
+
+
+def texts(name):
+    atlas = ATLASES[name]
+    randomized = random.Random(name)
+    return SAMPLES[name] + list(atlas.alphabet) + [
+        "".join(randomized.choice(atlas.alphabet)
+                for _ in range(randomized.randint(2, 8)))
+        for _ in range(200)
+    ]
+
+
+@pytest.mark.parametrize("name", sorted(ATLASES))
+def test_atlas_draws_like_the_font(name):
+    atlas = ATLASES[name]
+    for text in texts(name):
+        size = (atlas.font.getbbox(text, "1")[2] + 12, 40)
+        for xy in ((0, 0), (5, 1), (3, -2)):
+            for background in (0, 1):
+                pasted = Image.new('1', size, background)
+                atlas.text(pasted, xy, text, fill=(1 - background,))
+                drawn = Image.new('1', size, background)
+                ImageDraw.Draw(drawn).text(xy, text, font=atlas.font,
+                                           fill=(1 - background,))
+                assert pasted.tobytes() == drawn.tobytes(), (text, xy)
+
+
+@pytest.mark.parametrize("name", sorted(ATLASES))
+def test_atlas_measures_like_the_font(name):
+    atlas = ATLASES[name]
+    for text in texts(name):
+        assert atlas.getsize(text) == font_size(atlas.font, text), text
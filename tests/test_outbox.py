@@ -0,0 +1,206 @@
+"""The outbox must send every journaled Jira change once, in order."""
+
+import json
+import threading
+
+import pytest
+
+from core import outbox as outbox_module
+from core.outbox import Outbox
+
+TODO, IN_PROGRESS = "1", "3"
+
+
+class Issue:
+    def __init__(self, key):
+        self.key = self.id = key
+
+
+class FakeAPI:
+    """Records the Jira calls, raising what errors holds for an issue key."""
+
+    todo_status, in_progress_status = TODO, IN_PROGRESS
+
+    def __init__(self, errors=None, in_progress=()):
+        self.calls = []
+        self.errors = errors or {}
+        self.in_progress = list(in_progress)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def find_issue(self, key):
+        self.gate.wait()
+        errors = self.errors.get(key)
+        if errors:
+            raise errors.pop(0)
+        return Issue(key)
+
+    def add_time(self, issue, seconds):
+        self.calls.append(("time", issue.key, seconds))
+
+    def change_status(self, issue, status):
+        self.calls.append(("status", issue.key, status))
+
+    def my_issues(self, status):
+        assert status == IN_PROGRESS
+        return [Issue(key) for key in self.in_progress]
+
+
+class RecordingEvent(threading.Event):
+    """The outbox stop event, returning at once from the retry delays."""
+
+    def __init__(self):
+        super().__init__()
+        self.delays = []
+
+    def wait(self, timeout=None):
+        self.delays.append(timeout)
+        return self.is_set()
+
+
+def write_journal(filename, records):
+    with open(filename, "w") as journal:
+        for record in records:
+            journal.write(json.dumps(record) + "\n")
+
+
+def read_journal(filename):
+    with open(filename) as journal:
+        return [json.loads(line) for line in journal]
+
+
+def worklog(entry_id, key, seconds):
+    return {"id": entry_id, "type": "worklog", "issue": key, "seconds": seconds}
+
+
+def run(api, filename, **kwargs):
+    """Outbox on filename that is closed once it sent all it had pending."""
+    flushed = threading.Event()
+    outbox = Outbox(api, str(filename), on_flush=flushed.set, **kwargs)
+    assert flushed.wait(5)
+    outbox.close()
+    return outbox
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return tmp_path / "outbox.jsonl"
+
+
+def test_replays_pending_entries_after_restart(journal):
+    api = FakeAPI(errors={"PROJ-1": [ConnectionError("down")] * 100})
+    outbox = Outbox(api, str(journal))
+    outbox.worklog(Issue("PROJ-1"), 90.5)
+    outbox.transition(Issue("PROJ-1"), TODO)
+    outbox.close()
+
+    api = FakeAPI()
+    run(api, journal)
+    assert api.calls == [("time", "PROJ-1", 90), ("status", "PROJ-1", TODO)]
+
+
+def test_done_entries_are_compacted_away(journal):
+    write_journal(journal, [
+        worklog(1, "PROJ-1", 10),
+        worklog(2, "PROJ-2", 20),
+        {"done": [1]},
+        worklog(3, "PROJ-3", 30),
+    ])
+    with open(journal, "a") as torn:
+        torn.write('{"id": 4, "type": "wor')  # cut short by a crash
+    api = FakeAPI()
+    api.gate.clear()
+    flushed = threading.Event()
+    outbox = Outbox(api, str(journal), on_flush=flushed.set)
+    assert read_journal(journal) == [worklog(2, "PROJ-2", 20),
+                                     worklog(3, "PROJ-3", 30)]
+    api.gate.set()
+    assert flushed.wait(5)
+    outbox.close()
+    assert api.calls == [("time", "PROJ-2", 20), ("time", "PROJ-3", 30)]
+    assert outbox._next_id == 4
+    # nothing left to replay, the journal starts over
+    assert read_journal(journal) == []
+
+
+def test_adjacent_worklogs_of_an_issue_are_coalesced(journal):
+    write_journal(journal, [
+        worklog(1, "PROJ-1", 10),
+        worklog(2, "PROJ-1", 20),
+        {"id": 3, "type": "transition", "issue": "PROJ-1", "status": TODO},
+        worklog(4, "PROJ-1", 40),
+        worklog(5, "PROJ-2", 50),
+        worklog(6, "PROJ-1", 60),
+        worklog(7, "PROJ-1", 70),
+    ])
+    api = FakeAPI()
+    run(api, journal)
+    assert api.calls == [
+        ("time", "PROJ-1", 30),
+        ("status", "PROJ-1", TODO),
+        ("time", "PROJ-1", 40),
+        ("time", "PROJ-2", 50),
+        ("time", "PROJ-1", 130),
+    ]
+
+
+def test_start_stops_the_other_issues_in_progress(journal):
+    write_journal(journal, [{"id": 1, "type": "start", "issue": "PROJ-2"}])
+    api = FakeAPI(in_progress=["PROJ-1", "PROJ-2", "PROJ-3"])
+    run(api, journal)
+    assert api.calls == [("status", "PROJ-1", TODO),
+                         ("status", "PROJ-3", TODO),
+                         ("status", "PROJ-2", IN_PROGRESS)]
+
+
+def test_rejected_entries_are_parked(journal):
+    write_journal(journal, [
+        worklog(1, "GONE-1", 10),
+        worklog(2, "PROJ-1", 20),
+    ])
+    api = FakeAPI(errors={"GONE-1": [KeyError("GONE-1")]})
+    rejected = []
+    outbox = run(api, journal,
+                 on_error=lambda entry, exc: rejected.append(entry["id"]))
+    assert api.calls == [("time", "PROJ-1", 20)]
+    assert rejected == [1]
+    parked = read_journal(outbox.failed_filename)
+    assert [entry["id"] for entry in parked] == [1]
+    assert parked[0]["error"] == "'GONE-1'"
+    assert "failed_at" in parked[0]
+    assert read_journal(journal) == []
+
+
+def test_a_raising_callback_does_not_stop_the_worker(journal):
+    write_journal(journal, [
+        worklog(1, "GONE-1", 10),
+        worklog(2, "PROJ-1", 20),
+    ])
+    api = FakeAPI(errors={"GONE-1": [KeyError("GONE-1")]})
+
+    def on_error(entry, exc):
+        raise RuntimeError("callback")
+
+    run(api, journal, on_error=on_error)
+    assert api.calls == [("time", "PROJ-1", 20)]
+
+
+def test_transient_failures_back_off(journal, monkeypatch):
+    monkeypatch.setattr(outbox_module, "RETRY_MIN_DELAY", 1)
+    monkeypatch.setattr(outbox_module, "RETRY_MAX_DELAY", 4)
+    api = FakeAPI(errors={
+        "PROJ-1": [ConnectionError("down")] * 5,
+        "PROJ-2": [ConnectionError("down")],
+    })
+    flushed = threading.Event()
+    outbox = Outbox(api, str(journal), on_flush=flushed.set)
+    stop = outbox._stop = RecordingEvent()
+    outbox.worklog(Issue("PROJ-1"), 10)
+    assert flushed.wait(5)
+    flushed.clear()
+    outbox.worklog(Issue("PROJ-2"), 20)
+    assert flushed.wait(5)
+    outbox.close()
+    # doubling up to the maximum, back to the minimum after a success
+    assert stop.delays == [1, 2, 4, 4, 4, 1]
+    assert api.calls == [("time", "PROJ-1", 10), ("time", "PROJ-2", 20)]
@@ -0,0 +1,95 @@
+"""Timers must run each due function once, in order, on a steady clock."""
+
+import pytest
+
+from core import base
+from core.base import Timers
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(base, "monotonic", clock)
+    return clock
+
+
+def test_timers_due_together_run_in_the_order_added(clock):
+    timers = Timers()
+    ran = []
+    for name in "abcde":
+        timers.add(1, lambda name=name: ran.append(name))
+    timers.add(0.5, lambda: ran.append("first"))
+    timers.execute()
+    assert ran == []
+    clock.now += 1
+    timers.execute()
+    assert ran == ["first", "a", "b", "c", "d", "e"]
+    assert timers.time_until_next() is None
+
+
+def test_remove_by_tag_cancels_only_that_tag(clock):
+    timers = Timers()
+    ran = []
+    timers.add(1, lambda: ran.append("animation"), "animation")
+    timers.add(2, lambda: ran.append("animation 2"), "animation", repeat=True)
+    timers.add(3, lambda: ran.append("display"), "display")
+    timers.remove_by_tag("animation")
+    assert "animation" not in timers.tags
+    assert timers.time_until_next() == 3
+    clock.now += 10
+    timers.execute()
+    assert ran == ["display"]
+    assert timers.tags == {}
+
+
+def test_repeating_timer_removed_while_running_stops(clock):
+    timers = Timers()
+    ran = []
+
+    def tick():
+        ran.append(clock.now)
+        if len(ran) == 2:
+            timers.remove_by_tag("tick")
+
+    timers.add(1, tick, "tick", repeat=True)
+    for _ in range(5):
+        clock.now += 1
+        timers.execute()
+    assert ran == [1001, 1002]
+    assert timers.time_until_next() is None
+
+
+def test_late_repeating_timer_skips_missed_ticks(clock):
+    timers = Timers()
+    ran = []
+    timers.add(1, lambda: ran.append(clock.now), repeat=True)
+    clock.now += 3.5  # the loop was blocked for a while
+    timers.execute()
+    assert ran == [1003.5]  # once, not once per missed tick
+    # the original cadence is kept
+    assert timers.time_until_next() == pytest.approx(0.5)
+    clock.now += 0.5
+    timers.execute()
+    assert ran == [1003.5, 1004]
+
+
+def test_adding_a_timer_wakes_the_loop(clock):
+    timers = Timers()
+    changes = []
+    timers.on_change = lambda: changes.append(timers.time_until_next())
+    timers.add(5, lambda: None)
+    timers.add(2, lambda: None)
+    assert changes == [5, 2]
+
+
+def test_repeating_timers_need_an_interval(clock):
+    with pytest.raises(Exception):
+        Timers().add(0, lambda: None, repeat=True)